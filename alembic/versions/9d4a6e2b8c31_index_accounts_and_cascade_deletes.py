@@ -0,0 +1,48 @@
+"""Index exchange accounts by owner and cascade user deletes
+
+Revision ID: 9d4a6e2b8c31
+Revises: 3c8e5a1f9b27
+Create Date: 2026-10-18 17:05:22.481930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d4a6e2b8c31'
+down_revision: Union[str, Sequence[str], None] = '3c8e5a1f9b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+OWNER_INDEX = 'ix_exchange_accounts_owner_exchange_demo'
+
+
+def _replace_fk(table: str, column: str, ondelete: str | None):
+    # У початковій міграції FK без імені — Postgres назвав їх <table>_<column>_fkey
+    name = f'{table}_{column}_fkey'
+    with op.batch_alter_table(table) as batch_op:
+        batch_op.drop_constraint(name, type_='foreignkey')
+        batch_op.create_foreign_key(name, 'users', [column], ['id'], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Без блокування записів на великій таблиці
+    with op.get_context().autocommit_block():
+        op.create_index(
+            OWNER_INDEX, 'exchange_accounts', ['owner_id', 'exchange_name', 'is_demo'],
+            unique=False, postgresql_concurrently=True
+        )
+    _replace_fk('exchange_accounts', 'owner_id', 'CASCADE')
+    _replace_fk('portfolio_snapshots', 'user_id', 'CASCADE')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _replace_fk('portfolio_snapshots', 'user_id', None)
+    _replace_fk('exchange_accounts', 'owner_id', None)
+    with op.get_context().autocommit_block():
+        op.drop_index(OWNER_INDEX, table_name='exchange_accounts', postgresql_concurrently=True)
@@ -5,8 +5,98 @@ class Settings(BaseSettings):
     ENCRYPTION_KEY: str
     TELEGRAM_BOT_TOKEN: str
     GEMINI_API_KEY: str
+
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # Оновлення, що обробляються довше, логуються разом зі статистикою запитів до БД
+    SLOW_UPDATE_SECONDS: float = 1.0
+    # Трасування оновлень: дерево спанів (БД, біржі, ШІ, Telegram) для тих, що довші за поріг.
+    # TRACE_PROFILE_RATE — частка оновлень під cProfile; профіль зберігається в TRACE_PROFILE_DIR або в лог
+    TRACING_ENABLED: bool = False
+    TRACE_SLOW_SECONDS: float = 5.0
+    TRACE_PROFILE_RATE: float = 0.0
+    TRACE_PROFILE_DIR: str | None = None
+
+    # "polling" або "webhook"
+    BOT_MODE: str = "polling"
+    WEBHOOK_URL: str | None = None
+    WEBHOOK_PATH: str = "/telegram/webhook"
+    # Обов'язковий, якщо задано WEBHOOK_URL: інакше бот не стартує
+    WEBHOOK_SECRET: str | None = None
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8080
+    WEBHOOK_WORKERS: int = 32
+    WEBHOOK_QUEUE_SIZE: int = 1000
+    SHUTDOWN_TIMEOUT: float = 30.0
+
+    # /metrics у форматі Prometheus лише на окремому порту, не на публічному порту webhook.
+    # При BOT_WORKERS > 1 воркер N слухає METRICS_PORT + 1 + N
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int | None = None
+
+    # Більше 1 — оновлення обробляють окремі процеси, розподілені за id користувача
+    BOT_WORKERS: int = 1
+    SHARD_QUEUE_SIZE: int = 1000
+    # Скільки чекати місця в черзі переповненого воркера, перш ніж відкинути оновлення
+    SHARD_ROUTE_TIMEOUT: float = 5.0
+    SHARD_WORKER_CONCURRENCY: int = 32
+    # Скільки прийнятих, але ще не оброблених оновлень може тримати воркер; решта чекає в черзі
+    SHARD_WORKER_MAX_PENDING: int = 64
+
+    FSM_STATE_TTL: float = 3600.0
+    # Локальний кеш FSM узгоджений, лише поки користувача обслуговує один процес; 0 — вимкнено
+    FSM_CACHE_SIZE: int = 10000
+    FSM_CACHE_TTL: float = 5.0
+    FSM_CLEANUP_INTERVAL: float = 600.0
     
     AI_MODEL_NAME: str = "gemini-1.5-flash"
+    AI_CACHE_SIZE: int = 2048
+    AI_CACHE_TTL: float = 600.0
+    AI_MAX_CONCURRENCY: int = 4
+    AI_MAX_QUEUE: int = 100
+    AI_USER_RATE_PER_MINUTE: float = 3.0
+    AI_USER_BURST: float = 2.0
+    AI_SHORT_PROMPT_CHARS: int = 120
+    AI_QUOTA_RETRIES: int = 3
+    AI_RETRY_BASE_DELAY: float = 1.0
+
+    # redis://... — спільний кеш для кількох процесів; без нього кеш локальний
+    CACHE_BACKEND_URL: str | None = None
+    USER_CACHE_SIZE: int = 50000
+    USER_CACHE_TTL: float = 3600.0
+
+    CREDENTIAL_CACHE_SIZE: int = 4096
+    CREDENTIAL_CACHE_TTL: float = 3600.0
+
+    EXCHANGE_POOL_MAX_SIZE: int = 256
+    EXCHANGE_POOL_IDLE_TTL: float = 600.0
+    EXCHANGE_POOL_EVICT_INTERVAL: float = 60.0
+    TICKER_CACHE_TTL: float = 10.0
+    MARKET_SNAPSHOT_PATH: str = "data/markets.json"
+    MARKET_REFRESH_INTERVAL: float = 6 * 3600
+
+    # Ліміт для бірж, яких немає в scheduler.EXCHANGE_LIMITS
+    SCHEDULER_RATE: float = 10.0
+    SCHEDULER_BURST: float = 20.0
+    SCHEDULER_CONCURRENCY: int = 16
+
+    CIRCUIT_WINDOW_SIZE: int = 20
+    CIRCUIT_MIN_CALLS: int = 5
+    CIRCUIT_FAILURE_RATE: float = 0.5
+    CIRCUIT_SLOW_CALL_SECONDS: float = 10.0
+    CIRCUIT_RESET_TIMEOUT: float = 30.0
+
+    TELEGRAM_EDIT_INTERVAL: float = 1.0
+
+    PORTFOLIO_RESULT_TTL: float = 15.0
+    PORTFOLIO_RESULT_CACHE_SIZE: int = 10000
+
+    SNAPSHOT_MAX_AGE: float = 300.0
+    SNAPSHOT_REFRESH_INTERVAL: float = 120.0
+    SNAPSHOT_BATCH_SIZE: int = 50
     
     model_config = SettingsConfigDict(env_file=".env")
 
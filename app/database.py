@@ -1,10 +1,74 @@
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.config import settings
+from app.metrics import db_pool_wait_seconds, db_query_seconds
 
 DB_URL = settings.DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://")
 
-engine = create_async_engine(DB_URL, echo=False)
+
+class QueryStats:
+    """Лічильники роботи з БД в межах одного оновлення Telegram."""
+
+    __slots__ = ("queries", "db_time", "pool_wait")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+
+
+query_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул, що рахує час очікування вільного з'єднання (разом із підключенням нового)."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            db_pool_wait_seconds.observe(waited)
+            stats = query_stats.get()
+            if stats is not None:
+                stats.pool_wait += waited
+
+
+_STATEMENT_SERIES = {verb.upper(): db_query_seconds.labels(verb) for verb in ("select", "insert", "update", "delete")}
+_OTHER_STATEMENTS = db_query_seconds.labels("other")
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"]
+        _STATEMENT_SERIES.get(statement[:6].upper(), _OTHER_STATEMENTS).observe(elapsed)
+        stats = query_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+
+
+engine = create_async_engine(
+    DB_URL,
+    echo=False,
+    poolclass=TimedQueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+)
+instrument_engine(engine)
 
 AsyncSessionLocal = async_sessionmaker(
     bind=engine,
@@ -13,4 +77,3 @@ AsyncSessionLocal = async_sessionmaker(
 )
 
 Base = declarative_base()
-
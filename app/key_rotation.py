@@ -0,0 +1,158 @@
+"""Перешифрування API-ключів бірж новим ключем ENCRYPTION_KEY.
+
+Порядок ротації:
+    1. ENCRYPTION_KEY="новий_ключ,старий_ключ" і перезапуск бота (він читає обидва);
+    2. python -m app.key_rotation
+    3. ENCRYPTION_KEY="новий_ключ" і ще один перезапуск.
+
+Таблиця обходиться keyset-пагінацією з коротким комітом на кожну пачку, тож бот працює
+паралельно, а перерваний запуск продовжується з checkpoint-файлу. Наприкінці з кешу
+користувачів (CACHE_BACKEND_URL) видаляються закешовані біржі зі старими шифротекстами.
+
+Дані незавершених FSM-сценаріїв (fsm_states) не перешифровуються: вони живуть не довше
+FSM_STATE_TTL, а після кроку 3 сховище вважає нерозшифровні рядки порожніми.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from sqlalchemy import bindparam, select, update
+
+from app.config import settings
+from app.database import AsyncSessionLocal, engine
+from app.models import ExchangeAccount
+from app.repositories.cached_user_repo import ACCOUNTS_KEY_PREFIX, CacheBackend, user_cache
+from app.security import parse_keys
+
+logger = logging.getLogger(__name__)
+
+ENCRYPTED_FIELDS = ("api_key", "api_secret", "api_passphrase")
+
+
+def _is_current(token: str, primary: Fernet) -> bool:
+    try:
+        primary.decrypt(token.encode())
+        return True
+    except InvalidToken:
+        return False
+
+
+def _read_checkpoint(path: str | None) -> int:
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as f:
+        return int(f.read().strip() or 0)
+
+
+def _write_checkpoint(path: str | None, last_id: int):
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(last_id))
+    os.replace(tmp_path, path)
+
+
+async def rotate_encryption_keys(session_factory, keys: list[Fernet], batch_size: int = 500,
+                                 after_id: int = 0, checkpoint_path: str | None = None,
+                                 cache: CacheBackend | None = None) -> dict:
+    cipher, primary = MultiFernet(keys), keys[0]
+    table = ExchangeAccount.__table__
+    update_stmt = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values({field: bindparam(f"new_{field}") for field in ENCRYPTED_FIELDS})
+    )
+
+    last_id = max(after_id, _read_checkpoint(checkpoint_path))
+    stats = {"scanned": 0, "rotated": 0, "failed_ids": [], "last_id": last_id, "seconds": 0.0}
+    started = time.monotonic()
+
+    while True:
+        async with session_factory() as session:
+            stmt = (
+                select(table.c.id, *(table.c[field] for field in ENCRYPTED_FIELDS))
+                .where(table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            )
+            rows = (await session.execute(stmt)).all()
+            if not rows:
+                break
+
+            params = []
+            for row in rows:
+                tokens = {field: getattr(row, field) for field in ENCRYPTED_FIELDS}
+                if all(not token or _is_current(token, primary) for token in tokens.values()):
+                    continue
+                try:
+                    rotated = {
+                        f"new_{field}": cipher.rotate(token.encode()).decode() if token else token
+                        for field, token in tokens.items()
+                    }
+                except InvalidToken:
+                    # Жоден із ключів не підходить — рядок лишається як є, решта таблиці ротується далі
+                    logger.error(f"Key rotation: exchange_accounts.id={row.id} cannot be decrypted with any configured key")
+                    stats["failed_ids"].append(row.id)
+                    continue
+                params.append({"row_id": row.id, **rotated})
+
+            if params:
+                await session.execute(update_stmt, params)
+                await session.commit()
+
+        last_id = rows[-1].id
+        _write_checkpoint(checkpoint_path, last_id)
+
+        stats["scanned"] += len(rows)
+        stats["rotated"] += len(params)
+        stats["last_id"] = last_id
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Key rotation: scanned={stats['scanned']} rotated={stats['rotated']} "
+            f"failed={len(stats['failed_ids'])} last_id={last_id} ({stats['scanned'] / elapsed if elapsed else 0:.0f} rows/s)"
+        )
+
+    # Повний прохід завершено — наступна ротація має починатися з початку таблиці
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    # Спільний кеш (Redis) пережив би перезапуск зі старими шифротекстами — після кроку 3 це InvalidToken
+    if cache is not None:
+        await cache.delete_prefix(ACCOUNTS_KEY_PREFIX)
+
+    stats["seconds"] = time.monotonic() - started
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Re-encrypt exchange API keys with the primary ENCRYPTION_KEY")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--after-id", type=int, default=0, help="continue after this exchange_accounts.id")
+    parser.add_argument("--checkpoint", default="data/key_rotation.checkpoint")
+    args = parser.parse_args()
+
+    keys = parse_keys(settings.ENCRYPTION_KEY)
+    if len(keys) < 2:
+        logger.warning("ENCRYPTION_KEY contains a single key: every token is already current, nothing to rotate")
+
+    os.makedirs(os.path.dirname(args.checkpoint) or ".", exist_ok=True)
+    try:
+        stats = await rotate_encryption_keys(
+            AsyncSessionLocal, keys, args.batch_size, args.after_id, args.checkpoint, cache=user_cache,
+        )
+    finally:
+        await engine.dispose()
+    logger.info(f"Key rotation finished: {stats}")
+    if stats["failed_ids"]:
+        logger.error(
+            f"{len(stats['failed_ids'])} accounts were not rotated (no configured key decrypts them); "
+            "these users must re-add their exchanges before the old key is removed"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
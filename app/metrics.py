@@ -0,0 +1,320 @@
+"""Метрики у текстовому форматі Prometheus.
+
+Дочірні серії (набір значень міток) створюються один раз і далі кешуються: гарячий шлях
+тримає посилання на серію або робить один пошук у словнику за кортежем, без словників міток.
+Метрики змінюються лише з event loop, тому блокування не потрібні.
+"""
+import time
+from bisect import bisect_left
+from itertools import product
+from typing import Callable, Iterable
+
+from aiohttp import web
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._unlabelled = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def preallocate(self, *label_values: Iterable[str]):
+        """Створює серії для всіх комбінацій відомих значень міток, щоб вони були в експорті з нуля."""
+        for values in product(*label_values):
+            self.labels(*values)
+        return self
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._children.items():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled.inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._unlabelled.dec(amount)
+
+    def set(self, value: float):
+        self._unlabelled.set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        # Останній кошик — +Inf; лічильники не кумулятивні, сумуються лише при експорті
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def time(self, started: float):
+        """Записує час від started (time.perf_counter()) до зараз."""
+        self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabelled.observe(value)
+
+    def _render_child(self, values, child) -> list[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip((*self.buckets, float("inf")), child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors: list[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collect: Callable[[], None]):
+        """Функція, що перед кожним експортом переносить у gauges поточний стан компонента."""
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            collect()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+EXCHANGE_METHODS = ("load_markets", "fetch_balance", "fetch_tickers")
+
+# --- Біржі ---
+exchange_request_seconds = registry.histogram(
+    "exchange_request_seconds", "Latency of exchange API calls", ("exchange", "method"),
+)
+exchange_errors_total = registry.counter(
+    "exchange_errors_total", "Failed exchange API calls by error class", ("exchange", "method", "error"),
+)
+exchange_requests_in_flight = registry.gauge(
+    "exchange_requests_in_flight", "Exchange API calls currently waiting for a response", ("exchange",),
+)
+
+# --- Планувальник бірж (знімається зі ExchangeScheduler.stats() під час експорту) ---
+scheduler_queued = registry.gauge(
+    "exchange_scheduler_queued", "Jobs waiting in the exchange scheduler queue", ("exchange", "demo"),
+)
+scheduler_active = registry.gauge(
+    "exchange_scheduler_active", "Jobs currently running in the exchange scheduler", ("exchange", "demo"),
+)
+scheduler_wait_avg_seconds = registry.gauge(
+    "exchange_scheduler_wait_avg_seconds", "Average queue wait of completed scheduler jobs", ("exchange", "demo"),
+)
+scheduler_wait_max_seconds = registry.gauge(
+    "exchange_scheduler_wait_max_seconds", "Longest queue wait of a scheduler job", ("exchange", "demo"),
+)
+scheduler_throttled_seconds = registry.counter(
+    "exchange_scheduler_throttled_seconds_total", "Time exchange calls spent waiting for rate limit tokens", ("exchange", "demo"),
+)
+
+# --- Gemini ---
+ai_request_seconds = registry.histogram(
+    "ai_request_seconds", "Full Gemini response time", ("mode",),
+).preallocate(("single", "stream"))
+ai_first_chunk_seconds = registry.histogram(
+    "ai_first_chunk_seconds", "Time to the first streamed Gemini chunk",
+)
+ai_tokens_total = registry.counter(
+    "ai_tokens_total", "Gemini tokens reported in usage metadata", ("kind",),
+).preallocate(("prompt", "response"))
+ai_cache_hits_total = registry.counter("ai_cache_hits_total", "AI answers served from the answer cache")
+ai_errors_total = registry.counter("ai_errors_total", "Failed Gemini requests by error class", ("error",))
+ai_requests_in_flight = registry.gauge("ai_requests_in_flight", "Gemini requests in progress")
+# Черга AIDispatcher (знімається з AIDispatcher.stats() під час експорту)
+ai_queue_queued = registry.gauge("ai_queue_queued", "AI questions waiting for a Gemini slot")
+ai_queue_active = registry.gauge("ai_queue_active", "AI questions holding a Gemini slot")
+ai_queue_rejected_total = registry.counter("ai_queue_rejected_total", "AI questions rejected because the queue was full")
+ai_queue_wait_avg_seconds = registry.gauge("ai_queue_wait_avg_seconds", "Average wait for a Gemini slot")
+ai_queue_wait_max_seconds = registry.gauge("ai_queue_wait_max_seconds", "Longest wait for a Gemini slot")
+
+# --- БД ---
+db_query_seconds = registry.histogram(
+    "db_query_seconds", "Database statement execution time", ("statement",), DB_BUCKETS,
+).preallocate(("select", "insert", "update", "delete", "other"))
+db_pool_wait_seconds = registry.histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a pooled database connection", buckets=DB_BUCKETS,
+)
+
+# --- Telegram ---
+update_seconds = registry.histogram(
+    "telegram_update_seconds", "Update processing time including middlewares", ("event_type",),
+).preallocate(("message", "callback_query"))
+handler_seconds = registry.histogram(
+    "telegram_handler_seconds", "Handler latency per route", ("handler",),
+)
+handler_errors_total = registry.counter(
+    "telegram_handler_errors_total", "Handlers that raised", ("handler", "error"),
+)
+updates_in_flight = registry.gauge("telegram_updates_in_flight", "Updates being processed")
+
+
+def preallocate_exchanges(exchanges: Iterable[str]):
+    exchanges = tuple(exchanges)
+    exchange_request_seconds.preallocate(exchanges, EXCHANGE_METHODS)
+    exchange_requests_in_flight.preallocate(exchanges)
+
+
+def export_scheduler_stats(stats: dict):
+    for (exchange, is_demo), lane in stats.items():
+        labels = (exchange, "true" if is_demo else "false")
+        scheduler_queued.labels(*labels).set(lane["queued"])
+        scheduler_active.labels(*labels).set(lane["active"])
+        scheduler_wait_avg_seconds.labels(*labels).set(lane["avg_wait"])
+        scheduler_wait_max_seconds.labels(*labels).set(lane["max_wait"])
+        scheduler_throttled_seconds.labels(*labels).set(lane["throttled"])
+
+
+def export_ai_queue_stats(stats: dict):
+    ai_queue_queued.set(stats["queued"])
+    ai_queue_active.set(stats["active"])
+    ai_queue_rejected_total.labels().set(stats["rejected"])
+    ai_queue_wait_avg_seconds.set(stats["avg_wait"])
+    ai_queue_wait_max_seconds.set(stats["max_wait"])
+
+
+async def observe_exchange_call(exchange: str, method: str, awaitable):
+    """Чекає на виклик API біржі, записуючи затримку, помилки та кількість одночасних запитів."""
+    in_flight = exchange_requests_in_flight.labels(exchange)
+    in_flight.inc()
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    except Exception as e:
+        exchange_errors_total.labels(exchange, method, type(e).__name__).inc()
+        raise
+    finally:
+        exchange_request_seconds.labels(exchange, method).time(started)
+        in_flight.dec()
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+def build_metrics_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    return app
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    # Окремий слухач: назви хендлерів, помилки бірж і глибина черг не мають бути видні з інтернету
+    runner = web.AppRunner(build_metrics_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, JSON, Text, Index
 from sqlalchemy.orm import relationship
 from app.database import Base
 
@@ -7,7 +7,7 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     username = Column(String, unique=True)
 
-    exchanges = relationship("ExchangeAccount", back_populates="owner")
+    exchanges = relationship("ExchangeAccount", back_populates="owner", passive_deletes=True)
 
 class ExchangeAccount(Base):
     __tablename__ = "exchange_accounts"
@@ -19,5 +19,27 @@ class ExchangeAccount(Base):
     api_passphrase = Column(String, nullable=True)
     is_demo = Column(Boolean, default=False)
     
-    owner_id = Column(Integer, ForeignKey("users.id"))
-    owner = relationship("User", back_populates="exchanges")
\ No newline at end of file
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    owner = relationship("User", back_populates="exchanges")
+
+    # Префікс owner_id обслуговує всі вибірки бірж користувача
+    __table_args__ = (
+        Index("ix_exchange_accounts_owner_exchange_demo", "owner_id", "exchange_name", "is_demo"),
+    )
+
+class PortfolioSnapshot(Base):
+    __tablename__ = "portfolio_snapshots"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+
+    data = Column(JSON)
+    errors = Column(JSON)
+    updated_at = Column(DateTime(timezone=True))
+
+class FSMState(Base):
+    __tablename__ = "fsm_states"
+    key = Column(String, primary_key=True)
+
+    state = Column(String, nullable=True)
+    # Дані сценарію (зокрема ключі API, поки їх вводять) зберігаються зашифрованими
+    data = Column(Text, nullable=True)
+    expires_at = Column(DateTime(timezone=True), index=True)
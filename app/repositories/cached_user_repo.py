@@ -0,0 +1,158 @@
+import json
+from typing import Any, NamedTuple, Protocol
+
+from app.cache import TTLCache
+from app.config import settings
+from app.repositories.user_repo import UserRepository
+
+ACCOUNTS_KEY_PREFIX = "accounts:"
+
+
+class UserRecord(NamedTuple):
+    id: int
+    username: str | None
+
+
+class AccountRecord(NamedTuple):
+    """Незалежна від сесії копія ExchangeAccount (ключі лишаються зашифрованими)."""
+    id: int
+    exchange_name: str
+    api_key: str
+    api_secret: str
+    api_passphrase: str | None
+    is_demo: bool
+    owner_id: int
+
+
+class CacheBackend(Protocol):
+    async def get(self, key: str) -> Any | None: ...
+    async def set(self, key: str, value: Any): ...
+    async def delete(self, *keys: str): ...
+    async def delete_prefix(self, prefix: str): ...
+
+
+class LocalCacheBackend:
+    """Кеш у пам'яті процесу. Достатній, коли всі записи користувача йдуть через один процес."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Any | None:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: Any):
+        self._cache.set(key, value)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._cache.pop(key)
+
+    async def delete_prefix(self, prefix: str):
+        await self.delete(*(key for key in self._cache.keys() if key.startswith(prefix)))
+
+    def clear(self):
+        self._cache.clear()
+
+
+class RedisCacheBackend:
+    """Спільний для всіх процесів кеш: інвалідація в одному процесі видна всім."""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "cv:", client=None):
+        if client is None:
+            # Redis потрібен лише для цього бекенду
+            try:
+                from redis import asyncio as redis
+            except ImportError as e:
+                raise RuntimeError("CACHE_BACKEND_URL is set but the 'redis' package is not installed") from e
+            client = redis.from_url(url)
+        self._redis = client
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Any | None:
+        raw = await self._redis.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any):
+        await self._redis.set(self.prefix + key, json.dumps(value, separators=(",", ":")), ex=self.ttl)
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._redis.delete(*(self.prefix + key for key in keys))
+
+    async def delete_prefix(self, prefix: str, batch_size: int = 500):
+        # SCAN замість KEYS: не блокує Redis на великій базі
+        batch = []
+        async for key in self._redis.scan_iter(match=f"{self.prefix}{prefix}*", count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                await self._redis.delete(*batch)
+                batch.clear()
+        if batch:
+            await self._redis.delete(*batch)
+
+
+def build_cache_backend(url: str | None, maxsize: int, ttl: float) -> CacheBackend:
+    if url:
+        return RedisCacheBackend(url, ttl)
+    return LocalCacheBackend(maxsize, ttl)
+
+
+class CachedUserRepository(UserRepository):
+    """Read-through кеш користувачів і їхніх бірж поверх UserRepository.
+
+    Дані змінюються лише через add_account / delete_account / delete_all_user_data,
+    тож саме ці методи точково інвалідовують кеш.
+    """
+
+    def __init__(self, session, cache: CacheBackend):
+        super().__init__(session)
+        self.cache = cache
+
+    @staticmethod
+    def _user_key(user_id: int) -> str:
+        return f"user:{user_id}"
+
+    @staticmethod
+    def _accounts_key(user_id: int) -> str:
+        return f"{ACCOUNTS_KEY_PREFIX}{user_id}"
+
+    async def create_user_if_not_exists(self, telegram_id: int, username: str) -> UserRecord:
+        cached = await self.cache.get(self._user_key(telegram_id))
+        if cached is not None:
+            return UserRecord(*cached)
+
+        user = await super().create_user_if_not_exists(telegram_id, username)
+        record = UserRecord(user.id, user.username)
+        await self.cache.set(self._user_key(telegram_id), list(record))
+        return record
+
+    async def get_user_accounts(self, user_id: int) -> list[AccountRecord]:
+        cached = await self.cache.get(self._accounts_key(user_id))
+        if cached is not None:
+            return [AccountRecord(*row) for row in cached]
+
+        accounts = [
+            AccountRecord(a.id, a.exchange_name, a.api_key, a.api_secret, a.api_passphrase, bool(a.is_demo), a.owner_id)
+            for a in await super().get_user_accounts(user_id)
+        ]
+        await self.cache.set(self._accounts_key(user_id), [list(a) for a in accounts])
+        return accounts
+
+    async def add_account(self, user_id: int, *args, **kwargs):
+        account = await super().add_account(user_id, *args, **kwargs)
+        await self.cache.delete(self._accounts_key(user_id))
+        return account
+
+    async def delete_account(self, account_id: int, user_id: int) -> bool:
+        deleted = await super().delete_account(account_id, user_id)
+        if deleted:
+            await self.cache.delete(self._accounts_key(user_id))
+        return deleted
+
+    async def delete_all_user_data(self, user_id: int):
+        await super().delete_all_user_data(user_id)
+        await self.cache.delete(self._user_key(user_id), self._accounts_key(user_id))
+
+
+user_cache = build_cache_backend(settings.CACHE_BACKEND_URL, settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
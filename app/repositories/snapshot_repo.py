@@ -0,0 +1,34 @@
+from datetime import datetime, timezone
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import PortfolioSnapshot
+
+class SnapshotRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get_latest(self, user_id: int) -> PortfolioSnapshot | None:
+        return await self.session.get(PortfolioSnapshot, user_id, populate_existing=True)
+
+    async def save(self, user_id: int, data: dict, errors: list[str], commit: bool = True) -> PortfolioSnapshot:
+        snapshot = await self.session.merge(PortfolioSnapshot(
+            user_id=user_id,
+            data=data,
+            errors=errors,
+            updated_at=datetime.now(timezone.utc)
+        ))
+        if commit:
+            await self.session.commit()
+        return snapshot
+
+    async def delete(self, user_id: int):
+        await self.session.execute(delete(PortfolioSnapshot).where(PortfolioSnapshot.user_id == user_id))
+        await self.session.commit()
+
+    @staticmethod
+    def age_seconds(snapshot: PortfolioSnapshot) -> float:
+        updated_at = snapshot.updated_at
+        # SQLite повертає дату без часової зони — вона завжди збережена в UTC
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        return (datetime.now(timezone.utc) - updated_at).total_seconds()
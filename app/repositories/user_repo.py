@@ -1,27 +1,64 @@
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, insert
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import User, ExchangeAccount
+from app.tracing import traced
+
+_UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
 
 class UserRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
+    @traced
     async def create_user_if_not_exists(self, telegram_id: int, username: str) -> User:
-        stmt = select(User).where(User.id == telegram_id)
-        result = await self.session.execute(stmt)
-        user = result.scalars().first()
+        user = await self.session.get(User, telegram_id)
+        if user:
+            return user
 
-        if not user:
+        insert_ = _UPSERT_INSERTS.get(self.session.bind.dialect.name)
+        if insert_ is None:
             user = User(id=telegram_id, username=username)
             self.session.add(user)
             await self.session.commit()
-        return user
+            return user
+
+        # Паралельний /start того ж користувача не падає на унікальності
+        stmt = (
+            insert_(User).values(id=telegram_id, username=username)
+            .on_conflict_do_nothing(index_elements=[User.id])
+            .returning(User)
+        )
+        user = (await self.session.execute(stmt)).scalars().first()
+        await self.session.commit()
+        return user or await self.session.get(User, telegram_id)
 
+    @traced
     async def get_user_accounts(self, user_id: int) -> list[ExchangeAccount]:
         stmt = select(ExchangeAccount).where(ExchangeAccount.owner_id == user_id)
         result = await self.session.execute(stmt)
         return list(result.scalars().all())
 
+    @traced
+    async def get_accounts_for_users(self, user_ids: list[int]) -> list[ExchangeAccount]:
+        stmt = select(ExchangeAccount).where(ExchangeAccount.owner_id.in_(user_ids)).order_by(ExchangeAccount.owner_id, ExchangeAccount.id)
+        result = await self.session.execute(stmt)
+        return list(result.scalars().all())
+
+    @traced
+    async def get_owner_ids_after(self, after_id: int, limit: int) -> list[int]:
+        """Keyset-пагінація власників бірж (для фонових задач)."""
+        stmt = (
+            select(ExchangeAccount.owner_id)
+            .where(ExchangeAccount.owner_id > after_id)
+            .distinct()
+            .order_by(ExchangeAccount.owner_id)
+            .limit(limit)
+        )
+        result = await self.session.execute(stmt)
+        return list(result.scalars().all())
+
+    @traced
     async def add_account(self, user_id: int, exchange_name: str, api_key: str, api_secret: str, api_passphrase: str | None, is_demo: bool) -> ExchangeAccount:
         new_acc = ExchangeAccount(
             exchange_name=exchange_name,
@@ -35,23 +72,24 @@ class UserRepository:
         await self.session.commit()
         return new_acc
 
+    @traced
+    async def add_accounts(self, rows: list[dict]) -> int:
+        """Масова вставка бірж одним executemany (ключі мають бути вже зашифровані)."""
+        if not rows:
+            return 0
+        await self.session.execute(insert(ExchangeAccount), rows)
+        await self.session.commit()
+        return len(rows)
+
+    @traced
     async def delete_account(self, account_id: int, user_id: int) -> bool:
-        stmt = select(ExchangeAccount).where(ExchangeAccount.id == account_id, ExchangeAccount.owner_id == user_id)
+        stmt = delete(ExchangeAccount).where(ExchangeAccount.id == account_id, ExchangeAccount.owner_id == user_id)
         result = await self.session.execute(stmt)
-        acc = result.scalars().first()
-        
-        if acc:
-            await self.session.delete(acc)
-            await self.session.commit()
-            return True
-        return False
+        await self.session.commit()
+        return result.rowcount > 0
 
+    @traced
     async def delete_all_user_data(self, user_id: int):
-        """Видаляє користувача та всі його біржі."""
-        stmt_acc = delete(ExchangeAccount).where(ExchangeAccount.owner_id == user_id)
-        await self.session.execute(stmt_acc)
-        
-        stmt_user = delete(User).where(User.id == user_id)
-        await self.session.execute(stmt_user)
-        
+        """Видаляє користувача; біржі та знімок портфеля видаляє ON DELETE CASCADE."""
+        await self.session.execute(delete(User).where(User.id == user_id))
         await self.session.commit()
\ No newline at end of file
@@ -1,12 +1,66 @@
-from cryptography.fernet import Fernet
+from typing import NamedTuple
+from cryptography.fernet import Fernet, MultiFernet
+from app.cache import TTLCache
 from app.config import settings
 
-cipher = Fernet(settings.ENCRYPTION_KEY.encode())
+def parse_keys(keys: str) -> list[Fernet]:
+    return [Fernet(k.strip().encode()) for k in keys.split(",") if k.strip()]
+
+def build_cipher(keys: str) -> MultiFernet:
+    """ENCRYPTION_KEY може містити кілька ключів через кому: перший шифрує, решта лише розшифровують."""
+    return MultiFernet(parse_keys(keys))
+
+cipher = build_cipher(settings.ENCRYPTION_KEY)
+_default_cipher = cipher
 
 def encrypt_key(text: str, cipher: Fernet = None) -> str:
-    cipher = cipher or Fernet(settings.ENCRYPTION_KEY.encode())
+    cipher = cipher or _default_cipher
     return cipher.encrypt(text.encode()).decode() if text else None
 
 def decrypt_key(text: str, cipher: Fernet = None) -> str:
-    cipher = cipher or Fernet(settings.ENCRYPTION_KEY.encode())
-    return cipher.decrypt(text.encode()).decode() if text else None
\ No newline at end of file
+    cipher = cipher or _default_cipher
+    return cipher.decrypt(text.encode()).decode() if text else None
+
+
+class Credentials(NamedTuple):
+    api_key: str | None
+    api_secret: str | None
+    passphrase: str | None
+
+
+class CredentialProvider:
+    """Кеш розшифрованих ключів бірж: один раз розшифрували — повторно не платимо за Fernet."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def resolve(self, account_id: int | None, api_key: str, api_secret: str, api_passphrase: str | None) -> Credentials:
+        encrypted = (api_key, api_secret, api_passphrase)
+        cached = self._cache.get(account_id) if account_id is not None else None
+        # Порівнюємо шифротекст, щоб не віддати старі ключі після ротації чи заміни акаунта
+        if cached is not None and cached[0] == encrypted:
+            return cached[1]
+
+        creds = Credentials(decrypt_key(api_key), decrypt_key(api_secret), decrypt_key(api_passphrase))
+        if account_id is not None:
+            self._cache.set(account_id, (encrypted, creds))
+        return creds
+
+    def get(self, account) -> Credentials:
+        return self.resolve(account.id, account.api_key, account.api_secret, account.api_passphrase)
+
+    def get_many(self, accounts) -> dict[int, Credentials]:
+        return {acc.id: self.get(acc) for acc in accounts}
+
+    def invalidate(self, *account_ids: int):
+        for account_id in account_ids:
+            self._cache.pop(account_id)
+
+    def clear(self):
+        self._cache.clear()
+
+
+credentials = CredentialProvider(
+    maxsize=settings.CREDENTIAL_CACHE_SIZE,
+    ttl=settings.CREDENTIAL_CACHE_TTL,
+)
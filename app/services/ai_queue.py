@@ -0,0 +1,138 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
+
+from google.api_core.exceptions import ResourceExhausted
+
+from app.cache import TTLCache
+from app.config import settings
+from app.metrics import export_ai_queue_stats, registry
+from app.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class AIRateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class AIQueueFull(Exception):
+    pass
+
+
+class AIDispatcher:
+    """Черга запитів до Gemini: глобальний ліміт одночасних викликів, ліміт на користувача,
+    пріоритет коротких запитань."""
+
+    def __init__(self, concurrency: int, max_queue: int, user_rate: float, user_burst: float, short_prompt_chars: int):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.short_prompt_chars = short_prompt_chars
+
+        self._active = 0
+        self._heap: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._buckets = TTLCache(maxsize=100_000, ttl=3600)
+
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _check_rate(self, user_id: int):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self._buckets.set(user_id, bucket)
+        if not bucket.try_take():
+            self.rejected += 1
+            raise AIRateLimited(bucket.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, prompt: str, on_position: Callable[[int], Awaitable] | None = None):
+        self._check_rate(user_id)
+        started = time.monotonic()
+
+        if self._active < self.concurrency and not self._heap:
+            self._active += 1
+        else:
+            if len(self._heap) >= self.max_queue:
+                self.rejected += 1
+                raise AIQueueFull()
+
+            priority = 0 if len(prompt) <= self.short_prompt_chars else 1
+            entry = (priority, next(self._seq), asyncio.get_running_loop().create_future())
+            heapq.heappush(self._heap, entry)
+            try:
+                if on_position is not None:
+                    await on_position(sum(1 for other in self._heap if other < entry) + 1)
+                await entry[2]
+            except BaseException:
+                if entry[2].done() and not entry[2].cancelled():
+                    # Слот уже видали саме в момент скасування — повертаємо його
+                    self._release()
+                else:
+                    entry[2].cancel()
+                    self._heap.remove(entry)
+                    heapq.heapify(self._heap)
+                raise
+
+        wait = time.monotonic() - started
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        try:
+            yield
+        finally:
+            self.completed += 1
+            self._release()
+
+    def _release(self):
+        self._active -= 1
+        while self._heap and self._active < self.concurrency:
+            _, _, future = heapq.heappop(self._heap)
+            if future.done():
+                continue
+            self._active += 1
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._heap),
+            "active": self._active,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait": self.total_wait / self.completed if self.completed else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+async def retry_on_quota(factory: Callable[[], Awaitable], retries: int, base_delay: float):
+    """Повторює виклик Gemini при вичерпаній квоті з експоненційною затримкою та jitter."""
+    for attempt in range(retries + 1):
+        try:
+            return await factory()
+        except ResourceExhausted:
+            if attempt == retries:
+                raise
+            delay = base_delay * 2 ** attempt * random.uniform(0.5, 1.5)
+            logger.warning(f"Gemini quota exhausted, retry {attempt + 1}/{retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+ai_dispatcher = AIDispatcher(
+    concurrency=settings.AI_MAX_CONCURRENCY,
+    max_queue=settings.AI_MAX_QUEUE,
+    user_rate=settings.AI_USER_RATE_PER_MINUTE / 60,
+    user_burst=settings.AI_USER_BURST,
+    short_prompt_chars=settings.AI_SHORT_PROMPT_CHARS,
+)
+registry.add_collector(lambda: export_ai_queue_stats(ai_dispatcher.stats()))
@@ -1,13 +1,49 @@
+import hashlib
+import math
+import re
+import time
 import google.generativeai as genai
+from app.cache import TTLCache
 from app.config import settings
+from app.metrics import (
+    ai_cache_hits_total, ai_errors_total, ai_first_chunk_seconds, ai_request_seconds,
+    ai_requests_in_flight, ai_tokens_total,
+)
+from app.services.ai_queue import retry_on_quota
+from app.tracing import span
 
 # Налаштування API
 genai.configure(api_key=settings.GEMINI_API_KEY)
 
-async def get_gemini_advice(user_question: str, portfolio_data: str):
+model = genai.GenerativeModel('gemini-2.5-flash')
 
-    model = genai.GenerativeModel('gemini-2.5-flash')
+# Відповіді на однакові запитання для схожих портфелів
+answer_cache = TTLCache(maxsize=settings.AI_CACHE_SIZE, ttl=settings.AI_CACHE_TTL)
 
+def normalize_question(question: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+def portfolio_fingerprint(detailed: dict) -> str:
+    """Грубий відбиток портфеля: загальна сума з кроком ~25% та частки монет з кроком 5%."""
+    coins = {}
+    for assets in detailed.values():
+        for coin, info in assets.items():
+            coins[coin] = coins.get(coin, 0.0) + info["usd_val"]
+
+    total = sum(coins.values())
+    if total <= 0:
+        return "empty"
+
+    total_bucket = round(math.log(total, 1.25))
+    weights = sorted(
+        (coin, round(usd / total * 20))
+        for coin, usd in coins.items()
+        if usd / total >= 0.01
+    )
+    raw = f"{total_bucket}|" + ",".join(f"{coin}:{w}" for coin, w in weights)
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+def _build_prompt(user_question: str, portfolio_data: str) -> str:
     system_instruction = (
         "Ти — CryptoVision AI, харизматичний та досвідчений крипто-аналітик. "
         "Твоя мета — допомагати людям зрозуміти ринок, даючи глибокі, але зрозумілі поради.\n\n"
@@ -24,7 +60,7 @@ async def get_gemini_advice(user_question: str, portfolio_data: str):
         "4. Мова: Українська."
     )
 
-    full_prompt = f"""
+    return f"""
     {system_instruction}
 
     КОНТЕКСТ ПОРТФЕЛЯ: {portfolio_data}
@@ -33,14 +69,114 @@ async def get_gemini_advice(user_question: str, portfolio_data: str):
     Дай чітку, корисну та не довгу відповідь (макс. 200 слів).
     """
 
-    try:
-        response = await model.generate_content_async(
-            full_prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.3,
+_GENERATION_CONFIG = genai.types.GenerationConfig(
+    temperature=0.3,
+)
+
+_single_seconds = ai_request_seconds.labels("single")
+_stream_seconds = ai_request_seconds.labels("stream")
+_prompt_tokens = ai_tokens_total.labels("prompt")
+_response_tokens = ai_tokens_total.labels("response")
+
+def _record_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        _prompt_tokens.inc(getattr(usage, "prompt_token_count", 0) or 0)
+        _response_tokens.inc(getattr(usage, "candidates_token_count", 0) or 0)
+
+def get_cached_advice(user_question: str, fingerprint: str) -> str | None:
+    cached = answer_cache.get((normalize_question(user_question), fingerprint))
+    if cached is not None:
+        ai_cache_hits_total.inc()
+    return cached
 
+async def get_gemini_advice(user_question: str, portfolio_data: str, fingerprint: str | None = None):
+    cache_key = (normalize_question(user_question), fingerprint) if fingerprint else None
+    if cache_key is not None:
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            ai_cache_hits_total.inc()
+            return cached
+
+    full_prompt = _build_prompt(user_question, portfolio_data)
+
+    ai_requests_in_flight.inc()
+    started = time.perf_counter()
+    try:
+        with span("gemini", mode="single"):
+            response = await retry_on_quota(
+                lambda: model.generate_content_async(
+                    full_prompt,
+                    generation_config=_GENERATION_CONFIG
+                ),
+                settings.AI_QUOTA_RETRIES,
+                settings.AI_RETRY_BASE_DELAY
             )
+        _single_seconds.time(started)
+        _record_usage(response)
+        if not response.text:
+            return "❌ ШІ задумався і не зміг відповісти."
+        if cache_key is not None:
+            answer_cache.set(cache_key, response.text)
+        return response.text
+    except Exception as e:
+        ai_errors_total.labels(type(e).__name__).inc()
+        return f"⚠️ Помилка аналітики: {str(e)}"
+    finally:
+        ai_requests_in_flight.dec()
+
+async def stream_gemini_advice(user_question: str, portfolio_data: str, fingerprint: str | None = None):
+    """Як get_gemini_advice, але віддає відповідь шматками в міру генерації."""
+    cache_key = (normalize_question(user_question), fingerprint) if fingerprint else None
+    if cache_key is not None:
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            ai_cache_hits_total.inc()
+            yield cached
+            return
+
+    full_prompt = _build_prompt(user_question, portfolio_data)
+    parts = []
+
+    ai_requests_in_flight.inc()
+    started = time.perf_counter()
+    # Не with: між yield виконується код споживача, який не має потрапити всередину цього спану
+    trace = span("gemini", mode="stream", prompt_chars=len(full_prompt))
+    try:
+        response = await retry_on_quota(
+            lambda: model.generate_content_async(
+                full_prompt,
+                generation_config=_GENERATION_CONFIG,
+                stream=True
+            ),
+            settings.AI_QUOTA_RETRIES,
+            settings.AI_RETRY_BASE_DELAY
         )
-        return response.text if response.text else "❌ ШІ задумався і не зміг відповісти."
+        chunk = None
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Службові чанки (наприклад, лише finish_reason) не містять тексту
+                continue
+            if text:
+                if not parts:
+                    first_chunk = time.perf_counter() - started
+                    ai_first_chunk_seconds.observe(first_chunk)
+                    trace.set(first_chunk=f"{first_chunk:.3f}s")
+                parts.append(text)
+                yield text
+        _stream_seconds.time(started)
+        # Підсумкове використання токенів приходить в останньому чанку
+        _record_usage(chunk)
     except Exception as e:
-        return f"⚠️ Помилка аналітики: {str(e)}"
\ No newline at end of file
+        ai_errors_total.labels(type(e).__name__).inc()
+        trace.set(error=type(e).__name__)
+        yield f"\n\n⚠️ Помилка аналітики: {str(e)}"
+        return
+    finally:
+        trace.finish()
+        ai_requests_in_flight.dec()
+
+    if cache_key is not None and parts:
+        answer_cache.set(cache_key, "".join(parts))
@@ -0,0 +1,114 @@
+import re
+import numpy as np
+
+STABLECOINS = frozenset({"USDT", "USDC", "FDUSD", "DAI", "TUSD", "BUSD", "USDE", "PYUSD", "USD"})
+
+_COIN_TOKEN = re.compile(r"[A-Za-z0-9]{2,10}")
+
+# Запитання про доцільність дій чи рух ціни — це вже порада або прогноз, а не арифметика
+_ADVICE = re.compile(
+    r"\b(варт|порад|купува|продава|прогноз|ризик|впад|впаст|зрост|зрос|виросте|подорожча|подешева|буде|якщо)\w*"
+    r"|що робити"
+)
+# Цілі слова: «пил» не має спрацьовувати всередині «купили», а голий «%» — це ще не питання про частку
+_SHARE = re.compile(r"\b(частк|відсот)\w*")
+_DUST = re.compile(r"\b(пил|dust)\w*")
+
+
+class PortfolioAnalytics:
+    """Векторизована аналітика агрегованого портфеля (усі біржі разом)."""
+
+    def __init__(self, detailed: dict, dust_threshold: float = 1.0):
+        rows = [
+            (label, coin, info["usd_val"])
+            for label, assets in detailed.items()
+            for coin, info in assets.items()
+        ]
+        labels = np.array([r[0] for r in rows], dtype=object)
+        coins = np.array([r[1] for r in rows], dtype=object)
+        values = np.array([r[2] for r in rows], dtype=float)
+
+        self.coins, coin_idx = np.unique(coins, return_inverse=True)
+        self.exchanges, exchange_idx = np.unique(labels, return_inverse=True)
+
+        self.coin_values = np.bincount(coin_idx, weights=values, minlength=len(self.coins))
+        self.exchange_values = np.bincount(exchange_idx, weights=values, minlength=len(self.exchanges))
+        self.total = float(values.sum())
+
+        safe_total = self.total or 1.0
+        self.weights = self.coin_values / safe_total
+        self.exchange_weights = self.exchange_values / safe_total
+        # Індекс Герфіндаля–Гіршмана: 1.0 — усе в одній монеті
+        self.hhi = float((self.weights ** 2).sum())
+
+        is_stable = np.array([coin in STABLECOINS for coin in self.coins], dtype=bool)
+        self.stable_share = float(self.weights[is_stable].sum()) if len(self.coins) else 0.0
+
+        # Монети без ціни (usd_val == 0) — не пил, їхню вартість просто не вдалося оцінити
+        dust = (values > 0) & (values < dust_threshold)
+        self.dust_total = float(values[dust].sum())
+        self.dust_count = int(dust.sum())
+
+        self._order = np.argsort(-self.coin_values)
+
+    def share_of(self, coin: str) -> float | None:
+        matches = np.nonzero(self.coins == coin)[0]
+        return float(self.weights[matches[0]]) if len(matches) else None
+
+    def summary(self, top: int = 8) -> str:
+        """Компактний опис портфеля для промпту замість сирого переліку по біржах."""
+        if self.total <= 0:
+            return "Портфель порожній"
+
+        top_coins = ", ".join(
+            f"{self.coins[i]} {self.weights[i] * 100:.1f}% (${self.coin_values[i]:.0f})"
+            for i in self._order[:top]
+            if self.coin_values[i] > 0
+        )
+        others = len(self.coins) - min(top, len(self.coins))
+        exchanges = ", ".join(
+            f"{label} {w * 100:.0f}%" for label, w in zip(self.exchanges, self.exchange_weights)
+        )
+        text = f"Всього ${self.total:.2f}; монети: {top_coins}"
+        if others > 0:
+            text += f" (+{others} інших)"
+        text += (
+            f"; стейблкоїни {self.stable_share * 100:.1f}%; HHI {self.hhi:.2f}; біржі: {exchanges}"
+        )
+        if self.dust_count:
+            text += f"; пил ${self.dust_total:.2f} ({self.dust_count} поз.)"
+        return text
+
+    def answer(self, question: str) -> str | None:
+        """Відповідає на суто кількісні запитання без LLM. None — запитання не для локальної відповіді."""
+        q = question.lower()
+        if _ADVICE.search(q):
+            return None
+
+        if _SHARE.search(q):
+            if "стейбл" in q:
+                return f"🛡 Частка стейблкоїнів: `{self.stable_share * 100:.1f}%`"
+            if "біржах" in q or "біржі" in q:
+                lines = [
+                    f"🏛 {label}: `{w * 100:.1f}%` (${v:.2f})"
+                    for label, w, v in zip(self.exchanges, self.exchange_weights, self.exchange_values)
+                ]
+                return "\n".join(lines) if lines else None
+            for token in _COIN_TOKEN.findall(question):
+                coin = token.upper()
+                share = self.share_of(coin)
+                if share is not None:
+                    value = self.coin_values[self.coins == coin][0]
+                    return f"🔹 Частка {coin}: `{share * 100:.1f}%` (~${value:.2f})"
+            return None
+
+        if any(phrase in q for phrase in ("скільки всього", "загальна вартість", "вартість портфел", "скільки в мене грошей")):
+            return f"💵 Загальна вартість портфеля: `${self.total:.2f}`"
+
+        if "концентрац" in q or "hhi" in q:
+            return f"📊 Індекс концентрації (HHI): `{self.hhi:.2f}` (1.00 — усе в одній монеті)"
+
+        if _DUST.search(q):
+            return f"🧹 Дрібні залишки: `${self.dust_total:.2f}` у {self.dust_count} позиціях"
+
+        return None
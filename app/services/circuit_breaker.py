@@ -0,0 +1,97 @@
+import time
+from collections import deque
+
+from app.config import settings
+
+
+class CircuitBreaker:
+    """Запобіжник для однієї біржі: після серії збоїв швидко відмовляє, поки біржа не відновиться."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window_size: int, min_calls: int, failure_rate: float,
+                 slow_call_seconds: float, reset_timeout: float):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.avg_latency = 0.0
+        self._outcomes: deque[bool] = deque(maxlen=window_size)
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+        # HALF_OPEN: пропускаємо лише один пробний запит
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self, latency: float):
+        self.avg_latency = latency if not self.avg_latency else 0.8 * self.avg_latency + 0.2 * latency
+        # Надто повільна відповідь для користувача не краща за помилку
+        if latency > self.slow_call_seconds:
+            return self.record_failure()
+
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            self._outcomes.clear()
+            self.state = self.CLOSED
+        self._outcomes.append(True)
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            return self._open()
+
+        self._outcomes.append(False)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+            self._open()
+
+    def release(self):
+        """Звільняє пробний слот, якщо виклик завершився без висновку про стан біржі."""
+        self._probe_in_flight = False
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self._outcomes.clear()
+
+
+class CircuitBreakerRegistry:
+    def __init__(self):
+        self._breakers: dict[tuple[str, bool], CircuitBreaker] = {}
+
+    def get(self, exchange_name: str, is_demo: bool) -> CircuitBreaker:
+        key = (exchange_name, is_demo)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                window_size=settings.CIRCUIT_WINDOW_SIZE,
+                min_calls=settings.CIRCUIT_MIN_CALLS,
+                failure_rate=settings.CIRCUIT_FAILURE_RATE,
+                slow_call_seconds=settings.CIRCUIT_SLOW_CALL_SECONDS,
+                reset_timeout=settings.CIRCUIT_RESET_TIMEOUT,
+            )
+            self._breakers[key] = breaker
+        return breaker
+
+    def clear(self):
+        self._breakers.clear()
+
+
+circuit_breakers = CircuitBreakerRegistry()
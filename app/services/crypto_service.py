@@ -1,73 +1,120 @@
 import asyncio
+import logging
+import time
 import ccxt.async_support as ccxt
-from app.security import decrypt_key
+from ccxt.base.errors import NetworkError
+from app.metrics import exchange_errors_total
+from app.tracing import span
+from app.security import Credentials, credentials
+from app.services.exchange_pool import exchange_pool
+from app.services.ticker_cache import ticker_cache
+from app.services.market_store import market_store
+from app.services.scheduler import exchange_scheduler
+from app.services.circuit_breaker import circuit_breakers
+
+logger = logging.getLogger(__name__)
+
+# Останній успішний баланс кожного акаунта — віддається як застарілий, коли біржа недоступна
+last_known_balances: dict[int, dict] = {}
 
 class CryptoService:
     @staticmethod
-    async def get_balance(exchange_name: str, key: str, secret: str, pas: str = None, is_demo: bool = False):
-        exchange = None
+    def _create_exchange(exchange_name: str, creds: Credentials, is_demo: bool = False):
+        ex_class = getattr(ccxt, exchange_name)
+        config = {
+            'apiKey': creds.api_key,
+            'secret': creds.api_secret,
+            'enableRateLimit': True,
+            'timeout': 20000
+        }
+
+        d_pas = creds.passphrase
+        if d_pas and d_pas.lower() not in ["none", ""]:
+            config['password'] = d_pas
+
+        exchange = ex_class(config)
+
+        if is_demo:
+            exchange.set_sandbox_mode(True)
+        return exchange
+
+    @staticmethod
+    async def forget_account(account_id: int):
+        """Прибирає з пам'яті все, що стосується видаленого акаунта: клієнтів, ключі, кеш балансу."""
+        credentials.invalidate(account_id)
+        last_known_balances.pop(account_id, None)
+        for is_demo in (False, True):
+            await exchange_pool.discard((account_id, is_demo))
+
+    @staticmethod
+    def _unavailable(account_id: int | None, error: str) -> dict:
+        result = {"error": error}
+        if account_id in last_known_balances:
+            result["stale"] = last_known_balances[account_id]
+        return result
+
+    @staticmethod
+    async def get_balance(exchange_name: str, key: str, secret: str, pas: str = None, is_demo: bool = False, account_id: int = None):
+        breaker = circuit_breakers.get(exchange_name, is_demo)
+        if not breaker.allow():
+            exchange_errors_total.labels(exchange_name, "fetch_balance", "CircuitOpen").inc()
+            return CryptoService._unavailable(account_id, "біржа тимчасово недоступна, повторимо пізніше")
+
+        pool_key = (account_id, is_demo) if account_id is not None else None
+
+        def factory():
+            with span("decrypt_credentials"):
+                creds = credentials.resolve(account_id, key, secret, pas)
+            return CryptoService._create_exchange(exchange_name, creds, is_demo)
+
+        started = time.monotonic()
         try:
-            ex_class = getattr(ccxt, exchange_name)
-            config = {
-                'apiKey': decrypt_key(key),
-                'secret': decrypt_key(secret),
-                'enableRateLimit': True,
-                'timeout': 20000 
-            }
-            
-            d_pas = decrypt_key(pas)
-            if d_pas and d_pas.lower() not in ["none", ""]:
-                config['password'] = d_pas
-
-            exchange = ex_class(config)
-            
-            if is_demo:
-                exchange.set_sandbox_mode(True)
-
-            async with exchange:
-                balance_resp = await exchange.fetch_balance()
-                assets = {k: v for k, v in balance_resp.get('total', {}).items() if v > 0}
-                
-                if not assets:
-                    return {}
-
-                assets_with_usd = {}
-                symbols_to_fetch = []
-                
-                for coin in assets.keys():
-                    if coin != 'USDT' and coin != 'USD':
-                        symbols_to_fetch.append(f"{coin}/USDT")
-
-                tickers = {}
-                if symbols_to_fetch:
-                    try:
-                        tickers = await exchange.fetch_tickers(symbols_to_fetch)
-                    except Exception as e:
-                        print(f"Error fetching tickers for {exchange_name}: {e}")
-           
-                for coin, amount in assets.items():
-                    price = 0.0
-                    
-                    if coin == 'USDT' or coin == 'USD':
-                        price = 1.0
-                    else:
-                        pair = f"{coin}/USDT"
-                        if pair in tickers and 'last' in tickers[pair]:
-                             price = tickers[pair]['last']
-                        elif f"{coin}/USD" in tickers and 'last' in tickers[f"{coin}/USD"]:
-                             price = tickers[f"{coin}/USD"]['last'] 
-                    
-                    usd_val = amount * price
-                    
-                    assets_with_usd[coin] = {
-                        "amount": amount,
-                        "usd_val": usd_val
-                    }
-
-                return assets_with_usd
-                
+            with span("exchange", exchange=exchange_name, account=account_id, demo=is_demo):
+                async with exchange_pool.client(pool_key, factory) as exchange:
+                    result = await CryptoService._fetch_assets(exchange, exchange_name, is_demo)
+        except NetworkError as e:
+            breaker.record_failure()
+            return CryptoService._unavailable(account_id, str(e))
         except Exception as e:
+            # Помилки ключів/прав стосуються акаунта, а не стану біржі
+            breaker.release()
             return {"error": str(e)}
-        finally:
-            if exchange:
-                await exchange.close()
\ No newline at end of file
+        except BaseException:
+            breaker.release()
+            raise
+
+        breaker.record_success(time.monotonic() - started)
+        if account_id is not None:
+            last_known_balances[account_id] = result
+        return result
+
+    @staticmethod
+    async def _fetch_assets(exchange, exchange_name: str, is_demo: bool) -> dict:
+        with span("attach_markets"):
+            index = await market_store.attach(exchange_name, is_demo, exchange)
+        with span("fetch_balance"):
+            balance_resp = await exchange_scheduler.call((exchange_name, is_demo), "fetch_balance", exchange.fetch_balance)
+        assets = {k: v for k, v in balance_resp.get('total', {}).items() if v > 0}
+
+        if not assets:
+            return {}
+
+        graph = index.valuation
+        needs_prices = bool(graph.symbols_for(assets))
+
+        # Ціни публічні, тому всі спотові тікери біржі кешуються спільно для всіх користувачів
+        tickers = {}
+        if needs_prices:
+            try:
+                with span("fetch_tickers"):
+                    tickers = await ticker_cache.get(
+                        (exchange_name, is_demo),
+                        lambda: exchange_scheduler.call(
+                            (exchange_name, is_demo), "fetch_tickers", lambda: exchange.fetch_tickers(None, {'type': 'spot'})
+                        )
+                    )
+            except Exception as e:
+                logger.warning(f"Error fetching tickers for {exchange_name}: {e}")
+
+        with span("valuation", assets=len(assets)):
+            return graph.value(assets, tickers)
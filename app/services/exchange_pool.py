@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Hashable
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class _PooledClient:
+    __slots__ = ("exchange", "last_used", "in_use")
+
+    def __init__(self, exchange: Any):
+        self.exchange = exchange
+        self.last_used = time.monotonic()
+        self.in_use = 0
+
+
+class ExchangePool:
+    """Реєстр «теплих» клієнтів ccxt з LRU-обмеженням та виселенням за часом простою."""
+
+    def __init__(self, max_size: int, idle_ttl: float):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._clients: OrderedDict[Hashable, _PooledClient] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    @asynccontextmanager
+    async def client(self, key: Hashable | None, factory: Callable[[], Any]):
+        # Без ключа (наприклад, разовий виклик) клієнт не кешується
+        if key is None:
+            exchange = factory()
+            try:
+                yield exchange
+            finally:
+                await exchange.close()
+            return
+
+        pooled = self._clients.get(key)
+        if pooled is None:
+            pooled = _PooledClient(factory())
+            self._clients[key] = pooled
+        self._clients.move_to_end(key)
+
+        pooled.in_use += 1
+        try:
+            yield pooled.exchange
+        finally:
+            pooled.in_use -= 1
+            pooled.last_used = time.monotonic()
+            await self.evict()
+
+    async def discard(self, key: Hashable):
+        pooled = self._clients.pop(key, None)
+        if pooled is not None:
+            await _close_quietly(pooled.exchange)
+
+    async def evict(self):
+        now = time.monotonic()
+        to_close = []
+
+        # Найстаріші за використанням клієнти — на початку словника
+        for key, pooled in list(self._clients.items()):
+            over_limit = len(self._clients) > self.max_size
+            expired = now - pooled.last_used > self.idle_ttl
+            if not (over_limit or expired):
+                break
+            if pooled.in_use:
+                continue
+            del self._clients[key]
+            to_close.append(pooled.exchange)
+
+        for exchange in to_close:
+            await _close_quietly(exchange)
+
+    async def run_evictor(self, interval: float):
+        """Закриває простоєні клієнти, навіть коли після них пулом ніхто не користується."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict()
+            except Exception as e:
+                logger.warning(f"Exchange pool eviction failed: {e}")
+
+    async def close_all(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for pooled in clients:
+            await _close_quietly(pooled.exchange)
+
+
+async def _close_quietly(exchange: Any):
+    try:
+        await exchange.close()
+    except Exception:
+        pass
+
+
+exchange_pool = ExchangePool(
+    max_size=settings.EXCHANGE_POOL_MAX_SIZE,
+    idle_ttl=settings.EXCHANGE_POOL_IDLE_TTL,
+)
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any
+
+import ccxt.async_support as ccxt
+
+from app.config import settings
+from app.services.scheduler import exchange_scheduler
+from app.services.valuation import ValuationGraph
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+def _strip_info(entry: dict) -> dict:
+    # Сирі відповіді біржі ('info') займають більшу частину обсягу і для роботи не потрібні
+    compact = {k: v for k, v in entry.items() if k != 'info'}
+    networks = compact.get('networks')
+    if isinstance(networks, dict):
+        compact['networks'] = {n: _strip_info(v) for n, v in networks.items() if isinstance(v, dict)}
+    return compact
+
+
+class MarketIndex:
+    """Компактний індекс спотових ринків однієї біржі."""
+
+    __slots__ = ("markets", "currencies", "symbols", "quotes", "updated_at", "_valuation")
+
+    def __init__(self, markets: dict, currencies: dict | None = None, updated_at: float | None = None):
+        self.markets = markets
+        self.currencies = currencies or {}
+        self.updated_at = updated_at or time.time()
+        # symbol -> (base, quote, precision)
+        self.symbols: dict[str, tuple[str, str, dict]] = {}
+        # base -> доступні котирувальні валюти
+        self.quotes: dict[str, set[str]] = {}
+        self._valuation: ValuationGraph | None = None
+
+        for symbol, market in markets.items():
+            if not market.get('spot') or market.get('active') is False:
+                continue
+            base, quote = market.get('base'), market.get('quote')
+            if not base or not quote:
+                continue
+            self.symbols[symbol] = (base, quote, market.get('precision') or {})
+            self.quotes.setdefault(base, set()).add(quote)
+
+    def has_pair(self, base: str, quote: str) -> bool:
+        return quote in self.quotes.get(base, ())
+
+    @property
+    def valuation(self) -> ValuationGraph:
+        # Маршрути будуються один раз на знімок ринків, а не на кожен запит балансу
+        if self._valuation is None:
+            self._valuation = ValuationGraph(self.symbols)
+        return self._valuation
+
+    @classmethod
+    def from_exchange(cls, exchange: Any) -> "MarketIndex":
+        markets = {s: _strip_info(m) for s, m in (exchange.markets or {}).items()}
+        currencies = {c: _strip_info(v) for c, v in (exchange.currencies or {}).items()}
+        return cls(markets, currencies)
+
+
+class MarketStore:
+    """Завантажує ринки один раз на біржу та зберігає їх знімок на диск для швидкого старту."""
+
+    def __init__(self, path: str, refresh_interval: float):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._indexes: dict[tuple[str, bool], MarketIndex] = {}
+        self._loading: dict[tuple[str, bool], asyncio.Future] = {}
+
+    def get(self, exchange_name: str, is_demo: bool) -> MarketIndex | None:
+        return self._indexes.get((exchange_name, is_demo))
+
+    async def attach(self, exchange_name: str, is_demo: bool, exchange: Any) -> MarketIndex:
+        """Підставляє в клієнт уже відомі ринки або завантажує їх один раз для всієї біржі."""
+        key = (exchange_name, is_demo)
+        index = self._indexes.get(key)
+        if index is not None:
+            if not exchange.markets:
+                exchange.set_markets(index.markets, index.currencies)
+            return index
+
+        task = self._loading.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, exchange))
+            self._loading[key] = task
+        index = await asyncio.shield(task)
+        if not exchange.markets:
+            exchange.set_markets(index.markets, index.currencies)
+        return index
+
+    async def _load(self, key: tuple[str, bool], exchange: Any) -> MarketIndex:
+        try:
+            await exchange_scheduler.call(key, "load_markets", exchange.load_markets)
+            index = MarketIndex.from_exchange(exchange)
+            self._indexes[key] = index
+            await self.save_snapshot()
+            return index
+        finally:
+            self._loading.pop(key, None)
+
+    async def refresh(self, exchange_name: str, is_demo: bool):
+        # Ринки публічні, тож для оновлення достатньо клієнта без ключів
+        exchange = getattr(ccxt, exchange_name)({'enableRateLimit': True, 'timeout': 20000})
+        if is_demo:
+            exchange.set_sandbox_mode(True)
+        try:
+            await exchange_scheduler.call((exchange_name, is_demo), "load_markets", lambda: exchange.load_markets(True))
+            self._indexes[(exchange_name, is_demo)] = MarketIndex.from_exchange(exchange)
+        finally:
+            await exchange.close()
+
+    async def run_refresher(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            for exchange_name, is_demo in list(self._indexes):
+                try:
+                    await self.refresh(exchange_name, is_demo)
+                except Exception as e:
+                    logger.warning(f"Market refresh failed for {exchange_name}: {e}")
+            await self.save_snapshot()
+
+    async def load_snapshot(self):
+        try:
+            data = await asyncio.to_thread(self._read_snapshot)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Ignoring broken market snapshot {self.path}: {e}")
+            return
+
+        if data.get("version") != SNAPSHOT_VERSION:
+            return
+        for raw_key, entry in data.get("exchanges", {}).items():
+            exchange_name, _, mode = raw_key.partition(":")
+            self._indexes[(exchange_name, mode == "demo")] = MarketIndex(
+                entry["markets"], entry.get("currencies"), entry.get("updated_at")
+            )
+
+    async def save_snapshot(self):
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "exchanges": {
+                f"{name}:{'demo' if is_demo else 'real'}": {
+                    "updated_at": index.updated_at,
+                    "markets": index.markets,
+                    "currencies": index.currencies,
+                }
+                for (name, is_demo), index in self._indexes.items()
+            },
+        }
+        try:
+            await asyncio.to_thread(self._write_snapshot, data)
+        except Exception as e:
+            logger.warning(f"Failed to write market snapshot {self.path}: {e}")
+
+    def _read_snapshot(self) -> dict:
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_snapshot(self, data: dict):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Окремий тимчасовий файл на кожен запис: кілька бірж можуть зберігати знімок одночасно
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory or ".", suffix=".tmp", delete=False) as f:
+            json.dump(data, f, separators=(",", ":"), default=str)
+        os.replace(f.name, self.path)
+
+
+market_store = MarketStore(
+    path=settings.MARKET_SNAPSHOT_PATH,
+    refresh_interval=settings.MARKET_REFRESH_INTERVAL,
+)
@@ -1,38 +1,197 @@
 import asyncio
+from app.cache import TTLCache
+from app.config import settings
 from app.repositories.user_repo import UserRepository
+from app.repositories.snapshot_repo import SnapshotRepository
 from app.services.crypto_service import CryptoService
+from app.services.scheduler import exchange_scheduler
+from app.tracing import span, traced
+
+# Спільні для всіх екземплярів сервісу: збір портфеля, що вже виконується, та щойно отримані результати
+_inflight: dict[int, asyncio.Future] = {}
+_recent = TTLCache(maxsize=settings.PORTFOLIO_RESULT_CACHE_SIZE, ttl=settings.PORTFOLIO_RESULT_TTL)
 
 class PortfolioService:
-    def __init__(self, user_repo: UserRepository):
+    def __init__(self, user_repo: UserRepository, snapshot_repo: SnapshotRepository | None = None):
         self.repo = user_repo
+        self.snapshots = snapshot_repo
+
+    @staticmethod
+    def account_label(acc) -> str:
+        mode_str = "Demo" if acc.is_demo else "Real"
+        return f"{acc.exchange_name.upper()} ({mode_str})"
+
+    @staticmethod
+    def split_result(label: str, res: dict):
+        """Розбирає результат акаунта на (label, дані або None, текст помилки або None)."""
+        if "error" not in res:
+            return label, res, None
+
+        error = f"❌ {label}: {res['error']}"
+        if res.get("stale"):
+            return f"{label} (кеш)", res["stale"], error
+        return label, None, error
+
+    @staticmethod
+    def _fetch_balance(acc, user_id: int) -> asyncio.Future:
+        # Усі запити йдуть через спільний планувальник: ліміти бірж та черговість між користувачами
+        return exchange_scheduler.submit(
+            (acc.exchange_name, acc.is_demo),
+            user_id,
+            lambda: CryptoService.get_balance(
+                acc.exchange_name,
+                acc.api_key,
+                acc.api_secret,
+                acc.api_passphrase,
+                acc.is_demo,
+                account_id=acc.id
+            )
+        )
 
     async def get_full_portfolio(self, user_id: int):
-        accounts = await self.repo.get_user_accounts(user_id)
+        shared = await self._await_shared(user_id)
+        if shared is not None:
+            return shared
+
+        future = asyncio.ensure_future(self._load_portfolio(user_id))
+        _inflight[user_id] = future
+        return await asyncio.shield(future)
+
+    @traced
+    async def release_connection(self):
+        """Завершує транзакцію читання, щоб не тримати з'єднання з пулу під час довгого очікування
+        (біржі, ШІ). Без цього одночасні запити вичерпують пул, а FSM-сховищу вже нема з чим працювати."""
+        await self.repo.session.commit()
+
+    async def _load_portfolio(self, user_id: int):
+        try:
+            accounts = await self.repo.get_user_accounts(user_id)
+            await self.release_connection()
+            result = await self.collect_portfolio(user_id, accounts)
+            _recent.set(user_id, result)
+            return result
+        finally:
+            _inflight.pop(user_id, None)
+
+    @staticmethod
+    async def _await_shared(user_id: int):
+        """Повертає щойно отриманий або вже запитаний іншим викликом портфель, інакше None."""
+        recent = _recent.get(user_id)
+        if recent is not None:
+            return recent
+
+        future = _inflight.get(user_id)
+        if future is None:
+            return None
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Скасовано того, хто збирав портфель, а не нас — збираємо самі
+            if future.cancelled():
+                return None
+            raise
+
+    async def invalidate(self, user_id: int):
+        """Скидає кешовані дані після зміни набору бірж користувача."""
+        _recent.pop(user_id)
+        if self.snapshots is not None:
+            await self.snapshots.delete(user_id)
+
+    async def collect_portfolio(self, user_id: int, accounts: list):
         if not accounts:
             return {}, []
 
-        tasks = []
-        for acc in accounts:
-            tasks.append(CryptoService.get_balance(
-                acc.exchange_name, 
-                acc.api_key, 
-                acc.api_secret, 
-                acc.api_passphrase, 
-                acc.is_demo
-            ))
-        
-        results = await asyncio.gather(*tasks)
-        
+        with span("portfolio.collect", accounts=len(accounts)):
+            futures = [self._fetch_balance(acc, user_id) for acc in accounts]
+            results = await asyncio.gather(*futures)
+
         detailed_portfolio = {}
         errors = []
-        
+
         for acc, res in zip(accounts, results):
-            mode_str = "Demo" if acc.is_demo else "Real"
-            label = f"{acc.exchange_name.upper()} ({mode_str})"
-            
-            if "error" in res:
-                errors.append(f"❌ {label}: {res['error']}")
-            else:
-                detailed_portfolio[label] = res
-                
-        return detailed_portfolio, errors
\ No newline at end of file
+            label, data, error = self.split_result(self.account_label(acc), res)
+
+            if error:
+                errors.append(error)
+            if data is not None:
+                detailed_portfolio[label] = data
+
+        return detailed_portfolio, errors
+
+    @traced
+    async def get_fresh_snapshot(self, user_id: int, max_age: float):
+        """Повертає (detailed, errors, вік у секундах) зі знімка, якщо він не старший за max_age."""
+        if self.snapshots is None:
+            return None
+
+        snapshot = await self.snapshots.get_latest(user_id)
+        if snapshot is None:
+            return None
+
+        age = self.snapshots.age_seconds(snapshot)
+        if age > max_age:
+            return None
+        return snapshot.data, snapshot.errors or [], age
+
+    async def get_cached_portfolio(self, user_id: int, max_age: float):
+        """Як get_full_portfolio, але спершу пробує свіжий знімок з БД. Повертає ще й вік даних."""
+        cached = await self.get_fresh_snapshot(user_id, max_age)
+        if cached is not None:
+            return cached
+
+        detailed, errors = await self.get_full_portfolio(user_id)
+        await self.save_snapshot(user_id, detailed, errors)
+        return detailed, errors, 0.0
+
+    @traced
+    async def save_snapshot(self, user_id: int, detailed: dict, errors: list[str]):
+        if self.snapshots is not None:
+            await self.snapshots.save(user_id, detailed, errors)
+
+    async def iter_portfolio(self, user_id: int):
+        """Віддає (label, дані, помилка, скільки ще очікується) по кожному акаунту в міру готовності."""
+        shared = await self._await_shared(user_id)
+        if shared is not None:
+            detailed, errors = shared
+            for error in errors:
+                yield None, None, error, len(detailed)
+            for i, (label, data) in enumerate(detailed.items()):
+                yield label, data, None, len(detailed) - i - 1
+            return
+
+        # Реєструємося до першого await: інакше подвійне натискання встигне запустити другий збір,
+        # а паралельні get_full_portfolio не дочекаються цього самого результату
+        shared_future = asyncio.get_running_loop().create_future()
+        _inflight[user_id] = shared_future
+        detailed, errors = {}, []
+        tasks = []
+
+        async def fetch(acc):
+            return acc, await self._fetch_balance(acc, user_id)
+
+        try:
+            accounts = await self.repo.get_user_accounts(user_id)
+            await self.release_connection()
+
+            tasks = [asyncio.ensure_future(fetch(acc)) for acc in accounts]
+            pending = len(tasks)
+            for next_done in asyncio.as_completed(tasks):
+                acc, res = await next_done
+                pending -= 1
+                label, data, error = self.split_result(self.account_label(acc), res)
+                if error:
+                    errors.append(error)
+                if data is not None:
+                    detailed[label] = data
+                yield label, data, error, pending
+
+            _recent.set(user_id, (detailed, errors))
+            shared_future.set_result((detailed, errors))
+        finally:
+            # Якщо споживач перестав читати — не лишаємо запити до бірж висіти
+            for task in tasks:
+                task.cancel()
+            if not shared_future.done():
+                shared_future.cancel()
+            if _inflight.get(user_id) is shared_future:
+                del _inflight[user_id]
@@ -0,0 +1,161 @@
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Hashable, NamedTuple
+
+from app.config import settings
+from app.metrics import export_scheduler_stats, observe_exchange_call, registry
+from app.ratelimit import TokenBucket
+from app.tracing import span
+
+LaneKey = tuple[str, bool]
+
+
+class ExchangeLimits(NamedTuple):
+    rate: float  # одиниць ваги за секунду
+    burst: float
+    weights: dict[str, float]  # вага методу ccxt; відсутній метод важить 1
+
+    def weight(self, method: str) -> float:
+        return self.weights.get(method, 1)
+
+
+# Ліміти на IP/UID з документації бірж із запасом. load_markets у ccxt робить кілька запитів
+EXCHANGE_LIMITS = {
+    # 6000 ваги/хв; /api/v3/account — 20, /api/v3/ticker/24hr без символу — 80, exchangeInfo — 20
+    "binance": ExchangeLimits(rate=80, burst=400, weights={"fetch_balance": 20, "fetch_tickers": 80, "load_markets": 40}),
+    # 10 запитів/с на UID для гаманця, ринкові дані — окремий ширший ліміт
+    "bybit": ExchangeLimits(rate=10, burst=10, weights={"load_markets": 3}),
+    # баланс — 10 запитів за 2 с, тікери — 20 за 2 с
+    "okx": ExchangeLimits(rate=10, burst=10, weights={"fetch_balance": 2, "load_markets": 2}),
+    # пул ваги ~2000 за 30 с; accounts — 5, allTickers — 15, symbols і currencies — 4+3
+    "kucoin": ExchangeLimits(rate=60, burst=120, weights={"fetch_balance": 5, "fetch_tickers": 15, "load_markets": 7}),
+    # 10 запитів/с на ендпоінт
+    "bitget": ExchangeLimits(rate=10, burst=10, weights={"load_markets": 2}),
+}
+
+
+class _Job:
+    __slots__ = ("user_id", "factory", "future", "enqueued_at", "context")
+
+    def __init__(self, user_id: Hashable, factory: Callable[[], Awaitable[Any]], future: asyncio.Future):
+        self.user_id = user_id
+        self.factory = factory
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        # Завдання часто запускає вже інше завершене завдання, тож контекст (траса, статистика БД)
+        # береться від того, хто його поставив у чергу
+        self.context = contextvars.copy_context()
+
+
+class _Lane:
+    def __init__(self, limits: ExchangeLimits, concurrency: int):
+        self.limits = limits
+        self.bucket = TokenBucket(limits.rate, limits.burst)
+        self.concurrency = concurrency
+        self.active = 0
+        # Окрема черга на кожного користувача; порядок словника — черговість round-robin
+        self.queues: OrderedDict[Hashable, deque[_Job]] = OrderedDict()
+        self.queued = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.throttled = 0.0
+
+
+class ExchangeScheduler:
+    """Спільний для всіх користувачів планувальник запитів до бірж.
+
+    На кожну біржу (і окремо на її демо-режим) — обмеження одночасних завдань і справедлива черга:
+    користувачі обслуговуються по черзі, по одному завданню. Кожен виклик ccxt усередині
+    завдання проходить через call() і списує свою вагу з token bucket біржі.
+    """
+
+    def __init__(self, rate: float, burst: float, concurrency: int, limits: dict[str, ExchangeLimits] | None = None):
+        # rate/burst — для бірж, яких немає в limits
+        self.default_limits = ExchangeLimits(rate, burst, {})
+        self.limits = limits or {}
+        self.concurrency = concurrency
+        self._lanes: dict[LaneKey, _Lane] = {}
+
+    def _lane(self, lane_key: LaneKey) -> _Lane:
+        lane = self._lanes.get(lane_key)
+        if lane is None:
+            limits = self.limits.get(lane_key[0], self.default_limits)
+            lane = self._lanes[lane_key] = _Lane(limits, self.concurrency)
+        return lane
+
+    def submit(self, lane_key: LaneKey, user_id: Hashable, factory: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        lane = self._lane(lane_key)
+        future = asyncio.get_running_loop().create_future()
+        lane.queues.setdefault(user_id, deque()).append(_Job(user_id, factory, future))
+        lane.queued += 1
+        self._dispatch(lane)
+        return future
+
+    def _dispatch(self, lane: _Lane):
+        while lane.active < lane.concurrency and lane.queues:
+            user_id, queue = next(iter(lane.queues.items()))
+            job = queue.popleft()
+            if queue:
+                lane.queues.move_to_end(user_id)
+            else:
+                del lane.queues[user_id]
+            lane.queued -= 1
+
+            if job.future.done():
+                continue
+            lane.active += 1
+            task = asyncio.get_running_loop().create_task(self._run(lane, job), context=job.context)
+            job.future.add_done_callback(lambda f, t=task: t.cancel() if f.cancelled() else None)
+
+    async def call(self, lane_key: LaneKey, method: str, factory: Callable[[], Awaitable[Any]]):
+        """Чекає, доки ліміт біржі дозволить виклик method, і виконує його з метриками."""
+        lane = self._lane(lane_key)
+        started = time.monotonic()
+        await lane.bucket.take(lane.limits.weight(method))
+        lane.throttled += time.monotonic() - started
+        return await observe_exchange_call(lane_key[0], method, factory())
+
+    async def _run(self, lane: _Lane, job: _Job):
+        try:
+            wait = time.monotonic() - job.enqueued_at
+            lane.total_wait += wait
+            lane.max_wait = max(lane.max_wait, wait)
+
+            with span("scheduler.job", queued=f"{wait:.3f}s"):
+                result = await job.factory()
+            if not job.future.done():
+                job.future.set_result(result)
+        except asyncio.CancelledError:
+            job.future.cancel()
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            lane.active -= 1
+            lane.completed += 1
+            self._dispatch(lane)
+
+    def stats(self) -> dict:
+        return {
+            lane_key: {
+                "queued": lane.queued,
+                "active": lane.active,
+                "completed": lane.completed,
+                "avg_wait": lane.total_wait / lane.completed if lane.completed else 0.0,
+                "max_wait": lane.max_wait,
+                "throttled": lane.throttled,
+            }
+            for lane_key, lane in self._lanes.items()
+        }
+
+
+exchange_scheduler = ExchangeScheduler(
+    rate=settings.SCHEDULER_RATE,
+    burst=settings.SCHEDULER_BURST,
+    concurrency=settings.SCHEDULER_CONCURRENCY,
+    limits=EXCHANGE_LIMITS,
+)
+registry.add_collector(lambda: export_scheduler_stats(exchange_scheduler.stats()))
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import time
+from itertools import groupby
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.repositories.user_repo import UserRepository
+from app.repositories.snapshot_repo import SnapshotRepository
+from app.services.portfolio_service import PortfolioService
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotRefresher:
+    """Фоново оновлює знімки портфелів, проходячи власників бірж пачками."""
+
+    def __init__(self, session_factory, interval: float, batch_size: int):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+
+    async def refresh_all(self) -> int:
+        started = time.monotonic()
+        refreshed = 0
+        last_owner_id = 0
+
+        while True:
+            async with self.session_factory() as session:
+                repo = UserRepository(session)
+                owner_ids = await repo.get_owner_ids_after(last_owner_id, self.batch_size)
+                if not owner_ids:
+                    break
+                accounts = await repo.get_accounts_for_users(owner_ids)
+
+            try:
+                await self.refresh_batch(accounts)
+                refreshed += len(owner_ids)
+            except Exception as e:
+                logger.warning(f"Snapshot batch after owner {last_owner_id} failed: {e}")
+            last_owner_id = owner_ids[-1]
+
+        logger.info(f"Refreshed {refreshed} portfolio snapshots in {time.monotonic() - started:.1f}s")
+        return refreshed
+
+    async def refresh_batch(self, accounts: list):
+        by_owner = {owner_id: list(accs) for owner_id, accs in groupby(accounts, key=lambda a: a.owner_id)}
+        service = PortfolioService(user_repo=None)
+
+        results = await asyncio.gather(*(
+            service.collect_portfolio(owner_id, accs) for owner_id, accs in by_owner.items()
+        ))
+
+        async with self.session_factory() as session:
+            snapshots = SnapshotRepository(session)
+            for owner_id, (detailed, errors) in zip(by_owner, results):
+                await snapshots.save(owner_id, detailed, errors, commit=False)
+            await session.commit()
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh_all()
+            except Exception as e:
+                logger.error(f"Snapshot refresh failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+snapshot_refresher = SnapshotRefresher(
+    AsyncSessionLocal,
+    interval=settings.SNAPSHOT_REFRESH_INTERVAL,
+    batch_size=settings.SNAPSHOT_BATCH_SIZE,
+)
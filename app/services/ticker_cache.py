@@ -0,0 +1,51 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Hashable
+
+from app.config import settings
+
+
+class TickerCache:
+    """Спільний для всіх користувачів кеш цін з об'єднанням одночасних запитів до біржі."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: dict[Hashable, tuple[float, dict]] = {}
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[dict]]) -> dict:
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh(key, fetch))
+            task.add_done_callback(_consume_exception)
+            self._inflight[key] = task
+        # shield: скасування одного з очікувачів не зупиняє спільний запит
+        return await asyncio.shield(task)
+
+    async def _refresh(self, key: Hashable, fetch: Callable[[], Awaitable[dict]]) -> dict:
+        try:
+            tickers = await fetch()
+            self._entries[key] = (time.monotonic(), tickers)
+            return tickers
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+def _consume_exception(task: asyncio.Future):
+    # Помилку отримують очікувачі; тут лише прибираємо попередження, якщо їх не залишилось
+    if not task.cancelled():
+        task.exception()
+
+
+ticker_cache = TickerCache(ttl=settings.TICKER_CACHE_TTL)
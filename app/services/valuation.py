@@ -0,0 +1,101 @@
+from collections import deque
+
+# Валюти, вартість яких приймаємо за $1 без конвертації
+USD_ANCHORS = ("USDT", "USD")
+
+# Порядок, у якому перебираємо проміжні валюти: найліквідніші котирування першими
+HUB_PRIORITY = ("USDT", "USD", "USDC", "FDUSD", "BTC", "ETH", "BNB")
+
+
+def _hub_rank(currency: str) -> int:
+    try:
+        return HUB_PRIORITY.index(currency)
+    except ValueError:
+        return len(HUB_PRIORITY)
+
+
+def _ticker_price(ticker: dict | None) -> float | None:
+    if not ticker:
+        return None
+    price = ticker.get('last') or ticker.get('close')
+    if not price:
+        bid, ask = ticker.get('bid'), ticker.get('ask')
+        price = (bid + ask) / 2 if bid and ask else None
+    return float(price) if price else None
+
+
+class ValuationGraph:
+    """Граф котирувальних валют біржі з наперед обчисленими маршрутами конвертації в USD.
+
+    Для кожної валюти зберігаються ребра до сусідів, що на крок ближчі до USDT/USD
+    (напр. X→BTC→USDT), тому оцінка балансу — це один прохід по вже завантажених тікерах.
+    """
+
+    def __init__(self, symbols: dict[str, tuple[str, str, dict]]):
+        # currency -> [(сусід, символ, інвертувати ціну)]
+        adjacency: dict[str, list[tuple[str, str, bool]]] = {}
+        for symbol, (base, quote, _) in symbols.items():
+            adjacency.setdefault(base, []).append((quote, symbol, False))
+            adjacency.setdefault(quote, []).append((base, symbol, True))
+
+        # BFS від якорів: depth — мінімальна кількість конвертацій до долара
+        self.depth: dict[str, int] = {anchor: 0 for anchor in USD_ANCHORS}
+        queue = deque(USD_ANCHORS)
+        while queue:
+            currency = queue.popleft()
+            for neighbour, _, _ in sorted(adjacency.get(currency, ()), key=lambda e: _hub_rank(e[0])):
+                if neighbour not in self.depth:
+                    self.depth[neighbour] = self.depth[currency] + 1
+                    queue.append(neighbour)
+
+        # Кандидати на перший крок маршруту: прямі пари й ліквідні хаби першими
+        self.routes: dict[str, list[tuple[str, str, bool]]] = {}
+        for currency, depth in self.depth.items():
+            if depth == 0:
+                continue
+            steps = [e for e in adjacency[currency] if self.depth.get(e[0]) == depth - 1]
+            steps.sort(key=lambda e: (e[2], _hub_rank(e[0]), e[1]))
+            self.routes[currency] = steps
+
+    def symbols_for(self, currencies) -> set[str]:
+        """Усі символи, тікери яких можуть знадобитися для оцінки цих валют."""
+        needed, stack, seen = set(), list(currencies), set()
+        while stack:
+            currency = stack.pop()
+            if currency in seen:
+                continue
+            seen.add(currency)
+            for neighbour, symbol, _ in self.routes.get(currency, ()):
+                needed.add(symbol)
+                stack.append(neighbour)
+        return needed
+
+    def prices(self, currencies, tickers: dict) -> dict[str, float]:
+        """Ціни в USD для валют; якщо тікера на маршруті немає — пробує наступний маршрут."""
+        memo: dict[str, float | None] = {anchor: 1.0 for anchor in USD_ANCHORS}
+
+        def resolve(currency: str) -> float | None:
+            if currency in memo:
+                return memo[currency]
+            price = None
+            for neighbour, symbol, inverse in self.routes.get(currency, ()):
+                rate = _ticker_price(tickers.get(symbol))
+                if rate is None:
+                    continue
+                # depth сусіда строго менший, тож рекурсія не зациклюється
+                neighbour_price = resolve(neighbour)
+                if neighbour_price is None:
+                    continue
+                price = neighbour_price / rate if inverse else neighbour_price * rate
+                break
+            memo[currency] = price
+            return price
+
+        return {c: p for c in currencies if (p := resolve(c)) is not None}
+
+    def value(self, assets: dict[str, float], tickers: dict) -> dict[str, dict]:
+        prices = self.prices(assets, tickers)
+        return {
+            coin: {"amount": amount, "usd_val": amount * prices.get(coin, 0.0)}
+            for coin, amount in assets.items()
+        }
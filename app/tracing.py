@@ -0,0 +1,124 @@
+"""Легке трасування одного оновлення Telegram: дерево вкладених спанів у contextvars.
+
+Кореневий спан відкриває TracingMiddleware; усередині нього span(...) створює дочірні.
+Поза трасою span(...) повертає спільний порожній об'єкт — ціна вимкненого трасування
+зводиться до одного ContextVar.get().
+"""
+import functools
+import time
+from contextvars import ContextVar
+
+# Обмеження на кількість спанів в одній трасі, щоб цикли не роздували пам'ять
+MAX_SPANS = 500
+
+
+class Span:
+    __slots__ = ("name", "attrs", "started", "duration", "children", "_root", "_count", "_token")
+
+    def __init__(self, name: str, attrs: dict | None = None, root: "Span | None" = None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.started = time.perf_counter()
+        self.duration: float | None = None
+        self.children: list[Span] = []
+        self._root = root or self
+        self._count = 1
+        self._token = None
+
+    def child(self, name: str, attrs: dict | None = None) -> "Span | _NoopSpan":
+        root = self._root
+        if root._count >= MAX_SPANS:
+            return NOOP_SPAN
+        root._count += 1
+        span = Span(name, attrs, root)
+        # Дочірні задачі (gather) дописують у той самий список — у межах event loop це безпечно
+        self.children.append(span)
+        return span
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.started
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish()
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+
+    def render(self) -> str:
+        """Дерево спанів: зсув від початку траси, тривалість, атрибути."""
+        lines = []
+        self._render(lines, self.started, 0)
+        return "\n".join(lines)
+
+    def _render(self, lines: list[str], origin: float, depth: int):
+        duration = f"{self.duration:.3f}s" if self.duration is not None else "running"
+        attrs = " ".join(f"{k}={v}" for k, v in self.attrs.items())
+        lines.append(f"{'  ' * depth}+{self.started - origin:.3f}s {self.name} {duration}{' ' + attrs if attrs else ''}")
+        for child in sorted(self.children, key=lambda c: c.started):
+            child._render(lines, origin, depth + 1)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def child(self, name: str, attrs: dict | None = None) -> "_NoopSpan":
+        return self
+
+    def set(self, **attrs):
+        pass
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current: ContextVar[Span | None] = ContextVar("trace_span", default=None)
+
+
+def current_span() -> Span | _NoopSpan:
+    return _current.get() or NOOP_SPAN
+
+
+def span(name: str, **attrs) -> Span | _NoopSpan:
+    """Дочірній спан поточного: `with span("fetch_balance", exchange=name): ...`.
+
+    В асинхронних генераторах, де with охопив би й код споживача, спан не входять
+    у контекст, а завершують вручну через finish()."""
+    parent = _current.get()
+    if parent is None:
+        return NOOP_SPAN
+    return parent.child(name, attrs)
+
+
+def start_trace(name: str, **attrs) -> Span:
+    return Span(name, attrs)
+
+
+def traced(func):
+    """Обгортає корутину спаном з іменем Class.method."""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        parent = _current.get()
+        if parent is None:
+            return await func(*args, **kwargs)
+        with parent.child(name):
+            return await func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,158 @@
+"""Офлайн-замінники біржі, Telegram і Gemini для бенчмарків."""
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Message
+from ccxt.base.errors import NetworkError
+
+QUOTES = ("USDT", "BTC", "ETH")
+
+
+def build_markets(coins: int, seed: int = 7) -> tuple[dict, dict, dict]:
+    """Спотові ринки й тікери: частина монет має лише пару до BTC/ETH, щоб працювали крос-курси."""
+    rng = random.Random(seed)
+    markets, tickers = {}, {"BTC/USDT": {"last": 60000.0}, "ETH/USDT": {"last": 3000.0}, "ETH/BTC": {"last": 0.05}}
+    for base, quote in (("BTC", "USDT"), ("ETH", "USDT"), ("ETH", "BTC")):
+        markets[f"{base}/{quote}"] = _market(base, quote)
+
+    for i in range(coins):
+        base = f"C{i:04d}"
+        quotes = QUOTES if i % 3 == 0 else (QUOTES[i % 3],)
+        usd_price = rng.uniform(0.01, 500)
+        for quote in quotes:
+            symbol = f"{base}/{quote}"
+            markets[symbol] = _market(base, quote)
+            tickers[symbol] = {"last": usd_price / tickers[f"{quote}/USDT"]["last"] if quote != "USDT" else usd_price}
+
+    currencies = {c: {"id": c, "code": c} for c in {m["base"] for m in markets.values()} | set(QUOTES)}
+    return markets, currencies, tickers
+
+
+def _market(base: str, quote: str) -> dict:
+    return {
+        "symbol": f"{base}/{quote}", "base": base, "quote": quote, "spot": True, "active": True,
+        "precision": {"amount": 1e-6, "price": 1e-8},
+    }
+
+
+class FakeExchangeFactory:
+    """Підміняє модуль ccxt.async_support: getattr(ccxt, name)(config) повертає FakeExchange."""
+
+    def __init__(self, latency: float, jitter: float, error_rate: float, balance_size: int, coins: int, seed: int = 7):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.balance_size = balance_size
+        self.markets, self.currencies, self.tickers = build_markets(coins, seed)
+        self.coins = sorted({m["base"] for m in self.markets.values()})
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.created = 0
+
+    def __getattr__(self, exchange_name: str):
+        if exchange_name.startswith("_"):
+            raise AttributeError(exchange_name)
+        return lambda config: FakeExchange(self, exchange_name, config)
+
+    async def delay(self, method: str):
+        self.calls[method] += 1
+        await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        if self.rng.random() < self.error_rate:
+            raise NetworkError(f"simulated {method} failure")
+
+
+class FakeExchange:
+    def __init__(self, factory: FakeExchangeFactory, name: str, config: dict):
+        self.factory = factory
+        self.id = name
+        self.config = config
+        self.markets = None
+        self.currencies = None
+        factory.created += 1
+        # Баланс детермінований ключем, щоб у різних акаунтів були різні портфелі
+        rng = random.Random(config.get("apiKey"))
+        self._balance = {"USDT": rng.uniform(10, 1000)}
+        for coin in rng.sample(factory.coins, min(factory.balance_size, len(factory.coins))):
+            self._balance[coin] = rng.uniform(0.001, 100)
+
+    def set_sandbox_mode(self, enabled: bool):
+        pass
+
+    def set_markets(self, markets: dict, currencies: dict | None = None):
+        self.markets = markets
+        self.currencies = currencies or {}
+
+    async def load_markets(self, reload: bool = False):
+        await self.factory.delay("load_markets")
+        self.set_markets(self.factory.markets, self.factory.currencies)
+        return self.markets
+
+    async def fetch_balance(self, params=None):
+        await self.factory.delay("fetch_balance")
+        return {"total": dict(self._balance)}
+
+    async def fetch_tickers(self, symbols=None, params=None):
+        await self.factory.delay("fetch_tickers")
+        return self.factory.tickers
+
+    async def close(self):
+        self.factory.calls["close"] += 1
+
+
+class FakeTelegramSession(BaseSession):
+    """Сесія Bot API, що нічого не надсилає, а лише рахує виклики та імітує затримку."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1_000_000)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.__returning__ is Message:
+            return Message.model_validate({
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": method.chat_id, "type": "private"},
+                "text": getattr(method, "text", None),
+            }, context={"bot": bot})
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        if False:
+            yield b""
+
+    async def close(self):
+        pass
+
+
+class FakeGenerativeModel:
+    """Відповідає замість Gemini: затримка до першого токена, далі рівномірні чанки."""
+
+    def __init__(self, first_token: float, chunk_delay: float, chunks: int):
+        self.first_token = first_token
+        self.chunk_delay = chunk_delay
+        self.chunks = chunks
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        self.calls += 1
+        await asyncio.sleep(self.first_token)
+        parts = [f"**Пункт {i + 1}.** Тримайте баланс ризику. " for i in range(self.chunks)]
+        if not stream:
+            await asyncio.sleep(self.chunk_delay * self.chunks)
+            return SimpleNamespace(text="".join(parts))
+        return self._stream(parts)
+
+    async def _stream(self, parts):
+        for part in parts:
+            await asyncio.sleep(self.chunk_delay)
+            yield SimpleNamespace(text=part)
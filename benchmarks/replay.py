@@ -0,0 +1,306 @@
+"""Відтворення потоку оновлень Telegram із заданою швидкістю — перевірка ємності бота офлайн.
+
+    # Синтетичний трафік: 500 користувачів, 50 оновлень/с протягом 2 хвилин
+    python -m benchmarks.replay --users 500 --rate 50 --duration 120 --record traffic.jsonl
+
+    # Той самий (або записаний з продакшну) потік ще раз
+    python -m benchmarks.replay --input traffic.jsonl --rate 80 --output replay.json
+
+Вхідний файл — JSONL із сирими оновленнями Telegram (як їх віддає getUpdates).
+Оновлення одного користувача обробляються строго по черзі, різних — паралельно.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import resource
+import sys
+import time
+from collections import Counter, defaultdict, deque
+from typing import Iterator
+
+from aiogram.types import Update
+
+from benchmarks.harness import add_offline_arguments, latency_stats, offline_bot, quiet_logs
+from bot.handlers import SUPPORTED_EXCHANGES
+from bot.sharding import OrderedExecutor, shard_key
+
+# Сценарії: послідовність повідомлень одного користувача
+SCENARIOS = {
+    "balance": lambda rng: ["📊 Мій баланс"],
+    "profile": lambda rng: ["👤 Профіль"],
+    "ai": lambda rng: ["🤖 AI Порада", rng.choice(AI_QUESTIONS)],
+    "add_exchange": lambda rng: [
+        "🔌 Додати біржу", rng.choice(SUPPORTED_EXCHANGES).upper(), rng.choice(MODES),
+        f"key-{rng.getrandbits(64):x}", f"secret-{rng.getrandbits(64):x}", SKIP,
+    ],
+    "cancel_add": lambda rng: ["🔌 Додати біржу", "❌ Скасувати додавання"],
+}
+
+DEFAULT_MIX = "balance=45,profile=20,ai=15,add_exchange=10,cancel_add=10"
+
+AI_QUESTIONS = (
+    "Чи варто зараз купувати BTC?",
+    "Що робити з портфелем, якщо ринок просяде?",
+    "Яка частка BTC?",
+    "Скільки всього в мене грошей?",
+    "Як зменшити ризик?",
+)
+
+MODES = ("✅ Real Trading", "🧪 Demo / Sandbox")
+SKIP = "➡️ Пропустити (якщо не потрібно)"
+
+# Кнопки звітуються окремо, довільний текст (ключі, запитання) — однією групою
+BUTTONS = {
+    "📊 Мій баланс", "👤 Профіль", "🤖 AI Порада", "🔌 Додати біржу", "❌ Скасувати додавання", SKIP,
+    *MODES, *(name.upper() for name in SUPPORTED_EXCHANGES),
+}
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def synthesize(users: int, mix: dict[str, float], seed: int, active_sessions: int = 50) -> Iterator[dict]:
+    """Нескінченний потік оновлень: кілька користувачів одночасно проходять свої сценарії."""
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    ids = itertools.count(1)
+    active: dict[int, deque[str]] = {}
+
+    while True:
+        while len(active) < min(active_sessions, users):
+            user_id = rng.randint(1, users)
+            if user_id not in active:
+                active[user_id] = deque(SCENARIOS[rng.choices(names, weights)[0]](rng))
+
+        user_id = rng.choice(list(active))
+        text = active[user_id].popleft()
+        if not active[user_id]:
+            del active[user_id]
+
+        update_id = next(ids)
+        yield {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "text": text,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            },
+        }
+
+
+def load_recorded(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def update_kind(data: dict) -> str:
+    message = data.get("message")
+    if message is not None:
+        text = message.get("text") or ""
+        return text if text in BUTTONS else "free_text"
+    return next((k for k in data if k != "update_id"), "unknown")
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 2 ** 20
+    except OSError:
+        # Не Linux — лише пікове значення
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class LoopLagMonitor:
+    """Наскільки пізніше за заплановане прокидається event loop — ознака блокуючого коду."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: list[float] = []
+        self.window_max = 0.0
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.samples.append(lag)
+            self.window_max = max(self.window_max, lag)
+
+
+class Replayer:
+    def __init__(self, offline, rate: float, concurrency: int):
+        self.offline = offline
+        self.rate = rate
+        self.executor = OrderedExecutor(concurrency)
+        self.submitted = 0
+        self.done = 0
+        self.errors = Counter()
+        # Від запланованого моменту (разом з очікуванням у черзі користувача) і власне хендлер
+        self.latency: list[float] = []
+        self.handler_time: dict[str, list[float]] = defaultdict(list)
+
+    async def _handle(self, data: dict, scheduled_at: float):
+        started = time.perf_counter()
+        try:
+            update = Update.model_validate(data, context={"bot": self.offline.bot})
+            await self.offline.dp.feed_update(self.offline.bot, update)
+        except Exception as e:
+            self.errors[type(e).__name__] += 1
+        finished = time.perf_counter()
+        self.handler_time[update_kind(data)].append(finished - started)
+        self.latency.append(finished - scheduled_at)
+        self.done += 1
+
+    async def feed(self, stream: Iterator[dict], duration: float | None, limit: int | None):
+        """Розкладає оновлення рівномірно з частотою rate (відкрита модель навантаження)."""
+        started = time.perf_counter()
+        for i in itertools.count():
+            scheduled_at = started + i / self.rate
+            if (limit is not None and i >= limit) or (duration is not None and i / self.rate >= duration):
+                break
+            # Наступне оновлення беремо лише коли воно справді буде подане — --record пише рівно поданий потік
+            data = next(stream, None)
+            if data is None:
+                break
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.submitted += 1
+            self.executor.submit(shard_key(data), lambda d=data, t=scheduled_at: self._handle(d, t))
+        return time.perf_counter() - started
+
+
+async def sample_timeline(replayer: Replayer, lag: LoopLagMonitor, interval: float, timeline: list, started: float):
+    last_done, last_at = 0, started
+    while True:
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        timeline.append({
+            "t": round(now - started, 2),
+            "rss_mb": round(rss_mb(), 1),
+            "done": replayer.done,
+            "updates_per_sec": round((replayer.done - last_done) / (now - last_at), 2),
+            "backlog": replayer.submitted - replayer.done,
+            "loop_lag_max_ms": round(lag.window_max * 1000, 2),
+        })
+        lag.window_max = 0.0
+        last_done, last_at = replayer.done, now
+
+
+async def main(args) -> dict:
+    if args.input:
+        recorded = load_recorded(args.input)
+        user_ids = {shard_key(data) for data in recorded}
+        stream = itertools.cycle(recorded) if args.loop else iter(recorded)
+    else:
+        user_ids = range(1, args.users + 1)
+        stream = synthesize(args.users, args.mix, args.seed)
+
+    if args.record:
+        stream = _recording(stream, args.record)
+
+    async with offline_bot(args, user_ids) as offline:
+        replayer = Replayer(offline, args.rate, args.concurrency)
+        lag = LoopLagMonitor()
+        timeline: list[dict] = []
+        started = time.perf_counter()
+        rss_start = rss_mb()
+        background = [
+            asyncio.create_task(lag.run()),
+            asyncio.create_task(sample_timeline(replayer, lag, args.sample_interval, timeline, started)),
+        ]
+        try:
+            feed_seconds = await replayer.feed(stream, args.duration, args.limit)
+            await replayer.executor.join()
+        finally:
+            for task in background:
+                task.cancel()
+            if args.record:
+                stream.close()
+        total_seconds = time.perf_counter() - started
+        rss_end = rss_mb()
+
+    return {
+        "benchmark": "replay",
+        **offline.report(args),
+        "submitted": replayer.submitted,
+        "processed": replayer.done,
+        "errors": dict(replayer.errors),
+        "feed_seconds": round(feed_seconds, 2),
+        "total_seconds": round(total_seconds, 2),
+        "offered_rate": args.rate,
+        # Якщо бот не встигає, хвіст черги дообробляється після подачі — це знижує показник
+        "sustained_updates_per_sec": round(replayer.done / total_seconds, 2) if total_seconds else 0.0,
+        "latency": latency_stats(replayer.latency),
+        "handler_latency": {kind: latency_stats(values) for kind, values in sorted(replayer.handler_time.items())},
+        "loop_lag": latency_stats(lag.samples),
+        "memory": {
+            "rss_start_mb": round(rss_start, 1),
+            "rss_end_mb": round(rss_end, 1),
+            "rss_growth_mb": round(rss_end - rss_start, 1),
+        },
+        "timeline": timeline,
+    }
+
+
+def _recording(stream: Iterator[dict], path: str) -> Iterator[dict]:
+    with open(path, "w", encoding="utf-8") as f:
+        for data in stream:
+            f.write(json.dumps(data, ensure_ascii=False) + "\n")
+            yield data
+
+
+def print_report(report: dict):
+    print(
+        f"processed {report['processed']}/{report['submitted']} updates in {report['total_seconds']}s "
+        f"(offered {report['offered_rate']}/s, sustained {report['sustained_updates_per_sec']}/s), errors: {report['errors']}"
+    )
+    lat, lag, mem = report["latency"], report["loop_lag"], report["memory"]
+    print(f"latency p50/p95/p99: {lat['p50_ms']}/{lat['p95_ms']}/{lat['p99_ms']} ms")
+    print(f"loop lag p50/p99/max: {lag['p50_ms']}/{lag['p99_ms']}/{lag['max_ms']} ms")
+    print(f"RSS: {mem['rss_start_mb']} -> {mem['rss_end_mb']} MB")
+    print(f"\n{'update':<36} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for kind, stats in report["handler_latency"].items():
+        print(f"{kind:<36} {stats['count']:>6} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", help="JSONL із записаними оновленнями; без нього трафік синтезується")
+    parser.add_argument("--loop", action="store_true", help="повторювати записаний потік до --duration")
+    parser.add_argument("--record", help="зберегти поданий потік у JSONL для повторних запусків")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"ваги сценаріїв ({DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=20.0, help="оновлень за секунду")
+    parser.add_argument("--duration", type=float, default=60.0, help="секунд подачі")
+    parser.add_argument("--limit", type=int, help="максимум оновлень")
+    parser.add_argument("--concurrency", type=int, default=1000, help="одночасно оброблюваних оновлень")
+    parser.add_argument("--sample-interval", type=float, default=5.0, help="крок часової шкали, с")
+    add_offline_arguments(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    quiet_logs(args)
+    report = asyncio.run(main(args))
+    if args.output == "-":
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    else:
+        print_report(report)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
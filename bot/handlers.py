@@ -1,4 +1,5 @@
 import logging
+import math
 from aiogram import Router, F, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
@@ -14,23 +15,32 @@ from bot.keyboards import (
     get_cancel_kb,
     get_skip_kb
 )
-from app.security import encrypt_key, decrypt_key
-from app.services.ai_service import get_gemini_advice
+from bot.progress import ThrottledEditor, close_markdown
+from bot.middlewares import HandlerMetricsMiddleware
+from app.config import settings
+from app.metrics import preallocate_exchanges
+from app.security import encrypt_key, credentials
+from app.services.crypto_service import CryptoService
+from app.services.ai_service import stream_gemini_advice, portfolio_fingerprint, get_cached_advice
+from app.services.ai_queue import ai_dispatcher, AIRateLimited, AIQueueFull
+from app.services.analytics import PortfolioAnalytics
 
-from app.repositories.user_repo import UserRepository
+from app.repositories.cached_user_repo import CachedUserRepository, user_cache
+from app.repositories.snapshot_repo import SnapshotRepository
 from app.services.portfolio_service import PortfolioService
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 SUPPORTED_EXCHANGES = ["binance", "bybit", "okx", "kucoin", "bitget"]
+preallocate_exchanges(SUPPORTED_EXCHANGES)
 
 # --- Хендлери команд ---
 
 @router.message(Command("start"))
 async def cmd_start(message: types.Message, session: AsyncSession):
 
-    repo = UserRepository(session)
+    repo = CachedUserRepository(session, user_cache)
     await repo.create_user_if_not_exists(message.from_user.id, message.from_user.username)
     
     await message.answer(
@@ -41,7 +51,7 @@ async def cmd_start(message: types.Message, session: AsyncSession):
 
 @router.message(F.text == "👤 Профіль")
 async def cmd_profile(message: types.Message, session: AsyncSession):
-    repo = UserRepository(session)
+    repo = CachedUserRepository(session, user_cache)
     accounts = await repo.get_user_accounts(message.from_user.id)
     
     if not accounts:
@@ -49,9 +59,10 @@ async def cmd_profile(message: types.Message, session: AsyncSession):
     
     acc_data = []
     text = "👤 Ваші підключення:\n"
+    decrypted = credentials.get_many(accounts)
     
     for acc in accounts:
-        raw_key = decrypt_key(acc.api_key)
+        raw_key = decrypted[acc.id].api_key
         mask = f"{raw_key[:4]}...{raw_key[-4:]}" if len(raw_key) > 8 else "***"
         
         mode_str = "🧪 Demo" if acc.is_demo else "✅ Real"
@@ -60,21 +71,7 @@ async def cmd_profile(message: types.Message, session: AsyncSession):
         
     await message.answer(text, reply_markup=get_profile_kb(acc_data), parse_mode="Markdown")
 
-@router.message(F.text == "📊 Мій баланс")
-async def handle_balance(message: types.Message, session: AsyncSession):
-    status_msg = await message.answer("⏳ Збираю дані з бірж...")
-    
-    repo = UserRepository(session)
-    service = PortfolioService(repo)
-    
-    detailed, errors = await service.get_full_portfolio(message.from_user.id)
-    
-    if errors:
-        await message.answer("⚠️ Є зауваження:\n" + "\n".join(errors))
-        
-    if not detailed:
-        return await status_msg.edit_text("🤷‍♂️ Портфель порожній або помилка з'єднання.")
-        
+def render_balance(detailed: dict, pending: int = 0) -> str:
     res_text = "💰 Детальний баланс:\n"
     total_usd = 0.0
     
@@ -95,8 +92,49 @@ async def handle_balance(message: types.Message, session: AsyncSession):
         total_usd += subtotal
         
     res_text += f"\n══════════════\n💵 ВСЬОГО: `${total_usd:.2f}`"
+    if pending:
+        res_text += f"\n⏳ Ще очікую бірж: {pending}"
+    return res_text
+
+@router.message(F.text == "📊 Мій баланс")
+async def handle_balance(message: types.Message, session: AsyncSession):
+    status_msg = await message.answer("⏳ Збираю дані з бірж...")
+    
+    repo = CachedUserRepository(session, user_cache)
+    service = PortfolioService(repo, SnapshotRepository(session))
     
-    await status_msg.edit_text(res_text, parse_mode="Markdown")
+    cached = await service.get_fresh_snapshot(message.from_user.id, settings.SNAPSHOT_MAX_AGE)
+    if cached is not None:
+        detailed, errors, age = cached
+        if errors:
+            await message.answer("⚠️ Є зауваження:\n" + "\n".join(errors))
+        if not detailed:
+            return await status_msg.edit_text("🤷‍♂️ Портфель порожній або помилка з'єднання.")
+        return await status_msg.edit_text(
+            render_balance(detailed) + f"\n🕒 Оновлено {int(age)} с тому",
+            parse_mode="Markdown"
+        )
+    
+    editor = ThrottledEditor(status_msg, settings.TELEGRAM_EDIT_INTERVAL)
+    detailed, errors = {}, []
+    async for label, data, error, pending in service.iter_portfolio(message.from_user.id):
+        if error:
+            errors.append(error)
+        if data is None:
+            continue
+        detailed[label] = data
+        if pending:
+            await editor.update(render_balance(detailed, pending), parse_mode="Markdown")
+    
+    await service.save_snapshot(message.from_user.id, detailed, errors)
+    
+    if errors:
+        await message.answer("⚠️ Є зауваження:\n" + "\n".join(errors))
+        
+    if not detailed:
+        return await status_msg.edit_text("🤷‍♂️ Портфель порожній або помилка з'єднання.")
+    
+    await editor.flush(render_balance(detailed), parse_mode="Markdown")
 
 # --- AI Logic ---
 
@@ -109,21 +147,42 @@ async def ai_ask(message: types.Message, state: FSMContext):
 async def ai_handle_question(message: types.Message, state: FSMContext, session: AsyncSession):
     status_msg = await message.answer("🧠 ШІ аналізує ваш портфель...")
     
-    repo = UserRepository(session)
-    service = PortfolioService(repo)
-    detailed, _ = await service.get_full_portfolio(message.from_user.id)
+    repo = CachedUserRepository(session, user_cache)
+    service = PortfolioService(repo, SnapshotRepository(session))
+    detailed, _, _ = await service.get_cached_portfolio(message.from_user.id, settings.SNAPSHOT_MAX_AGE)
+    await service.release_connection()
+    
+    analytics = PortfolioAnalytics(detailed)
+    local_answer = analytics.answer(message.text)
+    if local_answer is not None:
+        await state.clear()
+        return await ThrottledEditor(status_msg, 0).flush(f"📜 Аналітика:\n\n{local_answer}", parse_mode="Markdown")
     
-    assets_str_parts = []
-    for label, assets in detailed.items():
-        if "error" in assets: continue
-        coins_info = ", ".join([f"{c}: {d['amount']:.4f} (${d['usd_val']:.2f})" for c, d in assets.items()])
-        assets_str_parts.append(f"[{label}: {coins_info}]")
+    assets_str = analytics.summary()
+    fingerprint = portfolio_fingerprint(detailed)
     
-    assets_str = "; ".join(assets_str_parts) if assets_str_parts else "Портфель порожній"
+    async def report_position(position: int):
+        await status_msg.edit_text(f"⏳ Ваше запитання в черзі до ШІ: {position}-е")
     
     try:
-        answer = await get_gemini_advice(message.text, assets_str)
-        await status_msg.edit_text(f"📜 Аналітика:\n\n{answer}", parse_mode="Markdown")
+        cached = get_cached_advice(message.text, fingerprint)
+        if cached is not None:
+            return await ThrottledEditor(status_msg, 0).flush(f"📜 Аналітика:\n\n{cached}", parse_mode="Markdown")
+        
+        async with ai_dispatcher.slot(message.from_user.id, message.text, report_position):
+            editor = ThrottledEditor(status_msg, settings.TELEGRAM_EDIT_INTERVAL)
+            answer = ""
+            async for chunk in stream_gemini_advice(message.text, assets_str, fingerprint):
+                answer += chunk
+                await editor.update(f"📜 Аналітика:\n\n{close_markdown(answer)} ▌", parse_mode="Markdown")
+        
+        if not answer.strip():
+            answer = "❌ ШІ задумався і не зміг відповісти."
+        await editor.flush(f"📜 Аналітика:\n\n{answer}", parse_mode="Markdown")
+    except AIRateLimited as e:
+        await status_msg.edit_text(f"⏳ Забагато запитань поспіль. Спробуйте через {math.ceil(e.retry_after)} с.")
+    except AIQueueFull:
+        await status_msg.edit_text("🚦 ШІ зараз перевантажений, спробуйте за хвилину.")
     except Exception as e:
         logger.error(f"AI Error: {e}")
         await status_msg.edit_text("❌ Помилка з'єднання з AI.")
@@ -193,8 +252,8 @@ async def add_pass(message: types.Message, state: FSMContext, session: AsyncSess
     enc_secret = encrypt_key(data['secret'])
     enc_pass = encrypt_key(passphrase) if passphrase else None
     
-    repo = UserRepository(session)
-    await repo.add_account(
+    repo = CachedUserRepository(session, user_cache)
+    new_acc = await repo.add_account(
         user_id=message.from_user.id,
         exchange_name=data['name'],
         api_key=enc_key,
@@ -202,6 +261,8 @@ async def add_pass(message: types.Message, state: FSMContext, session: AsyncSess
         api_passphrase=enc_pass,
         is_demo=data['is_demo']
     )
+    credentials.invalidate(new_acc.id)
+    await PortfolioService(repo, SnapshotRepository(session)).invalidate(message.from_user.id)
     
     await message.answer(f"✅ Біржу {data['name'].upper()} успішно додано!", reply_markup=get_main_kb(), parse_mode="Markdown")
     await state.clear()
@@ -211,11 +272,13 @@ async def add_pass(message: types.Message, state: FSMContext, session: AsyncSess
 @router.callback_query(F.data.startswith("del_ex_"))
 async def delete_exchange_callback(callback: types.CallbackQuery, session: AsyncSession):
     ex_id = int(callback.data.split("_")[2])
-    repo = UserRepository(session)
+    repo = CachedUserRepository(session, user_cache)
     
     success = await repo.delete_account(ex_id, callback.from_user.id)
     
     if success:
+        await CryptoService.forget_account(ex_id)
+        await PortfolioService(repo, SnapshotRepository(session)).invalidate(callback.from_user.id)
         await callback.answer("Видалено!")
         await callback.message.edit_text("✅ Біржу успішно видалено.")
     else:
@@ -227,7 +290,14 @@ async def confirm_delete_start(message: types.Message):
 
 @router.message(F.text == "❌ Так, видалити все")
 async def process_full_delete(message: types.Message, session: AsyncSession):
-    repo = UserRepository(session)
+    repo = CachedUserRepository(session, user_cache)
+    accounts = await repo.get_user_accounts(message.from_user.id)
     await repo.delete_all_user_data(message.from_user.id)
+    for acc in accounts:
+        await CryptoService.forget_account(acc.id)
+    await PortfolioService(repo).invalidate(message.from_user.id)
     
-    await message.answer("💨 Всі дані видалено. Бот перезавантажено.", reply_markup=types.ReplyKeyboardRemove())
\ No newline at end of file
+    await message.answer("💨 Всі дані видалено. Бот перезавантажено.", reply_markup=types.ReplyKeyboardRemove())
+
+# Після реєстрації всіх хендлерів
+HandlerMetricsMiddleware.install(router)
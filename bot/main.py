@@ -1,17 +1,95 @@
 import asyncio
+import signal
 import sys
 import os
 from aiogram import Bot, Dispatcher
 from bot.handlers import router
 from app.config import settings
-from bot.middlewares import DbSessionMiddleware
+from app.database import engine, AsyncSessionLocal
+from app.metrics import start_metrics_server
+from bot.middlewares import DbSessionMiddleware, TelegramRequestTracer, TracingMiddleware
+from bot.storage import SQLAlchemyStorage
+from bot.webhook import check_webhook_secret, run_webhook
+from bot.sharding import run_sharded
+from app.services.exchange_pool import exchange_pool
+from app.services.market_store import market_store
+from app.services.snapshot_refresher import snapshot_refresher
 
-async def main():
+def build_storage(session_factory=AsyncSessionLocal) -> SQLAlchemyStorage:
+    return SQLAlchemyStorage(
+        session_factory,
+        ttl=settings.FSM_STATE_TTL,
+        cache_size=settings.FSM_CACHE_SIZE,
+        cache_ttl=settings.FSM_CACHE_TTL,
+    )
+
+def build_bot() -> Bot:
     bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-    dp = Dispatcher()
+    if settings.TRACING_ENABLED:
+        bot.session.middleware(TelegramRequestTracer())
+    return bot
+
+def build_dispatcher(storage=None, session_factory=AsyncSessionLocal) -> Dispatcher:
+    dp = Dispatcher(storage=storage or build_storage())
     dp.include_router(router)
-    dp.update.middleware(DbSessionMiddleware())
-    await dp.start_polling(bot)
+    if settings.TRACING_ENABLED:
+        # Зовнішній middleware: у трасу потрапляють і сесія БД, і всі хендлери
+        dp.update.outer_middleware(TracingMiddleware())
+    dp.update.middleware(DbSessionMiddleware(session_factory))
+    return dp
+
+def _stop_event() -> asyncio.Event:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows
+    return stop
+
+async def main():
+    if settings.BOT_MODE == "webhook":
+        # Ще до запуску воркерів і фонових задач
+        check_webhook_secret(settings)
+    bot = build_bot()
+    storage = build_storage()
+    dp = build_dispatcher(storage)
+    metrics = None
+    if settings.METRICS_PORT:
+        metrics = await start_metrics_server(settings.METRICS_HOST, settings.METRICS_PORT)
+
+    if settings.BOT_WORKERS > 1:
+        # Оновлення обробляють дочірні процеси, тут лише прийом і маршрутизація
+        try:
+            await run_sharded(bot, dp, settings, _stop_event())
+        finally:
+            await bot.session.close()
+            if metrics is not None:
+                await metrics.cleanup()
+        return
+
+    await market_store.load_snapshot()
+    market_refresher = asyncio.create_task(market_store.run_refresher())
+    pool_evictor = asyncio.create_task(exchange_pool.run_evictor(settings.EXCHANGE_POOL_EVICT_INTERVAL))
+    portfolio_refresher = asyncio.create_task(snapshot_refresher.run())
+    fsm_cleanup = asyncio.create_task(storage.run_cleanup(settings.FSM_CLEANUP_INTERVAL))
+    try:
+        if settings.BOT_MODE == "webhook":
+            await run_webhook(bot, dp, settings, _stop_event())
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        fsm_cleanup.cancel()
+        portfolio_refresher.cancel()
+        pool_evictor.cancel()
+        market_refresher.cancel()
+        await exchange_pool.close_all()
+        await engine.dispose()
+        await bot.session.close()
+        if metrics is not None:
+            await metrics.cleanup()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
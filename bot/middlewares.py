@@ -1,15 +1,145 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import time
 from typing import Callable, Dict, Any, Awaitable
-from aiogram import BaseMiddleware
+from aiogram import BaseMiddleware, Router
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
 from aiogram.types import TelegramObject
-from app.database import AsyncSessionLocal
+from app.config import settings
+from app.database import AsyncSessionLocal, QueryStats, query_stats
+from app.metrics import handler_errors_total, handler_seconds, update_seconds, updates_in_flight
+from app.tracing import current_span, span, start_trace
+
+logger = logging.getLogger(__name__)
+
 
 class DbSessionMiddleware(BaseMiddleware):
+    def __init__(self, session_factory=AsyncSessionLocal, slow_update_seconds: float = settings.SLOW_UPDATE_SECONDS):
+        self.session_factory = session_factory
+        self.slow_update_seconds = slow_update_seconds
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        updates_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            # AsyncSession бере з'єднання з пулу лише на першому запиті, тож оновлення без БД пул не займають
+            async with self.session_factory() as session:
+                data["session"] = session
+                return await handler(event, data)
+        finally:
+            query_stats.reset(token)
+            updates_in_flight.dec()
+            elapsed = time.perf_counter() - started
+            update_seconds.labels(getattr(event, "event_type", "unknown")).observe(elapsed)
+            current_span().set(queries=stats.queries, db=f"{stats.db_time:.3f}s", pool_wait=f"{stats.pool_wait:.3f}s")
+            if elapsed >= self.slow_update_seconds:
+                logger.warning(
+                    f"Slow update {getattr(event, 'update_id', '?')} ({getattr(event, 'event_type', type(event).__name__)}): "
+                    f"{elapsed:.3f}s, {stats.queries} queries, db {stats.db_time:.3f}s, pool wait {stats.pool_wait:.3f}s"
+                )
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутрішній middleware роутера: час і помилки кожного хендлера окремо."""
+
+    @classmethod
+    def install(cls, router: Router):
+        middleware = cls()
+        for observer in (router.message, router.callback_query):
+            observer.middleware(middleware)
+            # Серії для всіх хендлерів створюються заздалегідь — в експорті вони є ще до першого виклику
+            handler_seconds.preallocate(handler.callback.__name__ for handler in observer.handlers)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = data["handler"].callback.__name__
+        current_span().set(handler=name)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            handler_errors_total.labels(name, type(e).__name__).inc()
+            raise
+        finally:
+            handler_seconds.labels(name).time(started)
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Кореневий спан на кожне оновлення; дерево спанів повільних оновлень іде в лог.
+
+    Частину оновлень можна профілювати cProfile. Профілювальник один на потік, тож профіль
+    охоплює весь event loop, зокрема паралельні оновлення, і одночасно профілюється лише одне."""
+
+    def __init__(
+        self,
+        slow_seconds: float = settings.TRACE_SLOW_SECONDS,
+        profile_rate: float = settings.TRACE_PROFILE_RATE,
+        profile_dir: str | None = settings.TRACE_PROFILE_DIR,
+    ):
+        self.slow_seconds = slow_seconds
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        self._profiling = False
+
     async def __call__(
         self,
         handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
         event: TelegramObject,
         data: Dict[str, Any]
     ) -> Any:
-        async with AsyncSessionLocal() as session:
-            data["session"] = session 
-            return await handler(event, data)
\ No newline at end of file
+        update_id = getattr(event, "update_id", "?")
+        trace = start_trace("update", id=update_id, type=getattr(event, "event_type", type(event).__name__))
+        profiler = self._start_profiler()
+        try:
+            with trace:
+                return await handler(event, data)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            if trace.duration >= self.slow_seconds:
+                logger.warning(f"Slow update {update_id} trace:\n{trace.render()}")
+                if profiler is not None:
+                    self._report_profile(update_id, profiler)
+
+    def _start_profiler(self) -> cProfile.Profile | None:
+        if self._profiling or self.profile_rate <= 0 or random.random() >= self.profile_rate:
+            return None
+        self._profiling = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _report_profile(self, update_id, profiler: cProfile.Profile):
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"update-{update_id}-{int(time.time())}.prof")
+            profiler.dump_stats(path)
+            logger.warning(f"Slow update {update_id} profile saved to {path}")
+            return
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(25)
+        logger.warning(f"Slow update {update_id} profile:\n{out.getvalue()}")
+
+
+class TelegramRequestTracer(BaseRequestMiddleware):
+    """Спан на кожен виклик Bot API (answer, edit_text тощо) в межах траси оновлення."""
+
+    async def __call__(self, make_request, bot, method):
+        with span("telegram", method=type(method).__name__):
+            return await make_request(bot, method)
@@ -0,0 +1,49 @@
+import time
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+
+class ThrottledEditor:
+    """Редагує статусне повідомлення не частіше за заданий інтервал (ліміти Telegram на edit)."""
+
+    def __init__(self, message: types.Message, min_interval: float):
+        self.message = message
+        self.min_interval = min_interval
+        self._last_edit = 0.0
+        self._last_text = None
+
+    async def update(self, text: str, parse_mode: str | None = None):
+        if time.monotonic() - self._last_edit < self.min_interval:
+            return
+        await self._edit(text, parse_mode)
+
+    async def flush(self, text: str, parse_mode: str | None = None):
+        await self._edit(text, parse_mode)
+
+    async def _edit(self, text: str, parse_mode: str | None):
+        if text == self._last_text:
+            return
+        try:
+            await self.message.edit_text(text, parse_mode=parse_mode)
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                pass
+            elif parse_mode and "can't parse entities" in str(e):
+                # Розмітка, яку Telegram не зміг розібрати, — показуємо як звичайний текст
+                await self.message.edit_text(text)
+            else:
+                raise
+        self._last_edit = time.monotonic()
+        self._last_text = text
+
+
+def close_markdown(text: str) -> str:
+    """Закриває незавершені сутності Markdown у тексті, що ще генерується."""
+    if text.count("```") % 2:
+        return text + "\n```"
+
+    closers = ""
+    for marker in ("`", "*", "_"):
+        if text.count(marker) % 2:
+            closers = marker + closers
+    return text + closers
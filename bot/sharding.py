@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import queue
+import signal
+import time
+from typing import Awaitable, Callable, Hashable
+
+from aiogram import Bot
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+# Поля оновлення, в яких Telegram передає автора
+_USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+def shard_key(update: dict) -> int:
+    for field in _USER_FIELDS:
+        event = update.get(field)
+        if not event:
+            continue
+        author = event.get("from") or event.get("chat")
+        if author and "id" in author:
+            return author["id"]
+    return update.get("update_id", 0)
+
+
+def shard_for(update: dict, shards: int) -> int:
+    """Усі оновлення одного користувача потрапляють в один процес — порядок зберігається."""
+    return shard_key(update) % shards
+
+
+class OrderedExecutor:
+    """Обробляє події паралельно, але події з однаковим ключем — строго по черзі."""
+
+    def __init__(self, concurrency: int):
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tails: dict[Hashable, asyncio.Task] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, key: Hashable, factory: Callable[[], Awaitable]) -> asyncio.Task:
+        previous = self._tails.get(key)
+        task = asyncio.create_task(self._run(previous, factory))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._done(key, t))
+        return task
+
+    async def _run(self, previous: asyncio.Task | None, factory: Callable[[], Awaitable]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with self._slots:
+            try:
+                await factory()
+            except Exception:
+                logger.exception("Sharded update failed")
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def join(self):
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+
+async def consume_updates(updates: mp.Queue, executor: OrderedExecutor, max_pending: int,
+                          handle: Callable[[dict], Awaitable]):
+    """Переносить оновлення з черги процесу в executor, тримаючи не більше max_pending необроблених.
+
+    Дозвіл береться до updates.get(): поки воркер зайнятий, оновлення лишаються в обмеженій
+    черзі, і ShardRouter.route() чекає або відкидає їх замість накопичення задач у пам'яті."""
+    permits = asyncio.Semaphore(max_pending)
+    while True:
+        await permits.acquire()
+        data = await asyncio.to_thread(updates.get)
+        if data is None:
+            permits.release()
+            return
+        task = executor.submit(shard_key(data), lambda d=data: handle(d))
+        task.add_done_callback(lambda _: permits.release())
+
+
+def _worker_entry(index: int, updates: mp.Queue):
+    # Зупинкою керує батьківський процес через sentinel у черзі
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_main(index, updates))
+
+
+async def _worker_main(index: int, updates: mp.Queue):
+    # Імпорт у дочірньому процесі: кожен воркер створює власні пул БД і клієнти бірж
+    from app.config import settings
+    from app.database import engine
+    from app.services.exchange_pool import exchange_pool
+    from app.services.market_store import market_store
+    from app.services.snapshot_refresher import snapshot_refresher
+    from app.metrics import start_metrics_server
+    from bot.main import build_bot, build_dispatcher, build_storage
+
+    bot = build_bot()
+    storage = build_storage()
+    dp = build_dispatcher(storage)
+    executor = OrderedExecutor(settings.SHARD_WORKER_CONCURRENCY)
+
+    # У кожного процесу власні метрики, тож і власний порт
+    metrics = None
+    if settings.METRICS_PORT:
+        metrics = await start_metrics_server(settings.METRICS_HOST, settings.METRICS_PORT + 1 + index)
+
+    await market_store.load_snapshot()
+    background = [
+        asyncio.create_task(market_store.run_refresher()),
+        # Пул клієнтів у кожного процесу свій
+        asyncio.create_task(exchange_pool.run_evictor(settings.EXCHANGE_POOL_EVICT_INTERVAL)),
+    ]
+    if index == 0:
+        # Спільні фонові задачі достатньо виконувати в одному процесі
+        background.append(asyncio.create_task(snapshot_refresher.run()))
+        background.append(asyncio.create_task(storage.run_cleanup(settings.FSM_CLEANUP_INTERVAL)))
+
+    async def handle(data: dict):
+        try:
+            update = Update.model_validate(data, context={"bot": bot})
+        except Exception as e:
+            logger.warning(f"Shard worker {index} dropped malformed update: {e}")
+            return
+        await dp.feed_update(bot, update)
+
+    logger.info(f"Shard worker {index} started")
+    try:
+        await consume_updates(updates, executor, settings.SHARD_WORKER_MAX_PENDING, handle)
+        await asyncio.wait_for(executor.join(), settings.SHUTDOWN_TIMEOUT)
+    finally:
+        for task in background:
+            task.cancel()
+        await exchange_pool.close_all()
+        await engine.dispose()
+        await bot.session.close()
+        if metrics is not None:
+            await metrics.cleanup()
+
+
+class ShardRouter:
+    """Фронтовий процес: розкидає оновлення по воркерах і перезапускає тих, що впали."""
+
+    def __init__(
+        self, shards: int, queue_size: int, restart_delay: float = 1.0, route_timeout: float = 5.0,
+        worker: Callable[[int, mp.Queue], None] = _worker_entry,
+    ):
+        self.shards = shards
+        self.queue_size = queue_size
+        self.restart_delay = restart_delay
+        self.route_timeout = route_timeout
+        self._worker = worker
+        self._ctx = mp.get_context("spawn")
+        self._queues: list[mp.Queue | None] = [None] * shards
+        self._processes: list[mp.Process | None] = [None] * shards
+        self.restarts = 0
+        self.dropped = 0
+        self._stopping = False
+
+    def _spawn(self, index: int):
+        # Нова черга на кожен запуск: воркер, убитий посеред updates.get(), лишає захопленим
+        # міжпроцесний lock читача, і наступник на старій черзі чекав би вічно
+        updates = self._ctx.Queue(maxsize=self.queue_size)
+        process = self._ctx.Process(
+            target=self._worker, args=(index, updates), name=f"bot-shard-{index}", daemon=True
+        )
+        process.start()
+        self._queues[index] = updates
+        self._processes[index] = process
+
+    def _discard_queue(self, index: int) -> int:
+        """Закриває чергу померлого воркера; оновлення, що в ній лишились, втрачаються."""
+        updates = self._queues[index]
+        try:
+            lost = updates.qsize()
+        except NotImplementedError:
+            lost = 0  # macOS
+        updates.close()
+        # Фідер-потік може висіти на повному pipe без читача — не чекаємо його при виході
+        updates.cancel_join_thread()
+        return lost
+
+    def start(self):
+        for index in range(self.shards):
+            self._spawn(index)
+
+    async def supervise(self):
+        while not self._stopping:
+            await asyncio.sleep(self.restart_delay)
+            for index, process in enumerate(self._processes):
+                if process is not None and not process.is_alive() and not self._stopping:
+                    lost = self._discard_queue(index)
+                    self.dropped += lost
+                    logger.warning(
+                        f"Shard worker {index} exited with {process.exitcode}, restarting; {lost} queued updates dropped"
+                    )
+                    self.restarts += 1
+                    self._spawn(index)
+
+    async def route(self, data: dict) -> bool:
+        target = self._queues[shard_for(data, self.shards)]
+        try:
+            target.put_nowait(data)
+            return True
+        except queue.Full:
+            pass
+        # Воркер не встигає — пригальмовуємо прийом, але не довше route_timeout,
+        # щоб один завислий шард не зупинив оновлення всіх користувачів
+        try:
+            await asyncio.to_thread(target.put, data, True, self.route_timeout)
+            return True
+        except (queue.Full, ValueError):
+            # ValueError — черга вже закрита після перезапуску воркера
+            self.dropped += 1
+            logger.warning(f"Shard queue for update {data.get('update_id')} is full, update dropped")
+            return False
+
+    async def feed_update(self, bot: Bot, update: Update):
+        """Сумісний з Dispatcher.feed_update, щоб WebhookServer міг віддавати оновлення воркерам."""
+        await self.route(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+
+    async def stop(self, timeout: float):
+        self._stopping = True
+        for updates in self._queues:
+            if updates is None:
+                continue
+            try:
+                await asyncio.to_thread(updates.put, None, True, timeout)
+            except queue.Full:
+                pass  # Воркер не розбирає чергу — нижче його буде зупинено terminate()
+
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+
+
+async def poll_updates(bot: Bot, handler: Callable[[Update], Awaitable], allowed_updates: list[str], stop: asyncio.Event):
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.warning(f"get_updates failed: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await handler(update)
+            offset = update.update_id + 1
+
+
+async def run_sharded(bot: Bot, dp, settings, stop: asyncio.Event):
+    """Запускає settings.BOT_WORKERS процесів; поточний процес лише приймає оновлення."""
+    router = ShardRouter(settings.BOT_WORKERS, settings.SHARD_QUEUE_SIZE, route_timeout=settings.SHARD_ROUTE_TIMEOUT)
+    router.start()
+    supervisor = asyncio.create_task(router.supervise())
+    try:
+        if settings.BOT_MODE == "webhook":
+            from bot.webhook import run_webhook
+            await run_webhook(bot, _RoutingDispatcher(dp, router), settings, stop)
+        else:
+            await bot.delete_webhook()
+            polling = asyncio.create_task(
+                poll_updates(bot, lambda u: router.feed_update(bot, u), dp.resolve_used_update_types(), stop)
+            )
+            await stop.wait()
+            polling.cancel()
+    finally:
+        supervisor.cancel()
+        await router.stop(settings.SHUTDOWN_TIMEOUT)
+
+
+class _RoutingDispatcher:
+    def __init__(self, dp, router: ShardRouter):
+        self._dp = dp
+        self._router = router
+
+    def resolve_used_update_types(self) -> list[str]:
+        return self._dp.resolve_used_update_types()
+
+    async def feed_update(self, bot: Bot, update: Update):
+        await self._router.feed_update(bot, update)
@@ -0,0 +1,171 @@
+import asyncio
+import copy
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from cryptography.fernet import InvalidToken
+from sqlalchemy import case, delete, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from app.cache import TTLCache
+from app.models import FSMState
+from app.security import decrypt_key, encrypt_key
+
+logger = logging.getLogger(__name__)
+
+
+def _row_key(key: StorageKey) -> str:
+    return ":".join((
+        str(key.bot_id), str(key.chat_id), str(key.user_id),
+        str(key.thread_id or ""), key.business_connection_id or "", key.destiny,
+    ))
+
+
+class SQLAlchemyStorage(BaseStorage):
+    """FSM-сховище в БД, спільне для всіх процесів бота.
+
+    Один рядок на ключ: стан і зашифрований JSON даних. Незавершені сценарії
+    застарівають через ttl.
+
+    Короткий локальний кеш (write-through) знімає SELECT з кожного оновлення. Він узгоджений,
+    лише коли всі оновлення користувача обробляє один процес: так є в одному процесі та з
+    BOT_WORKERS>1, де ShardRouter закріплює користувача за воркером. Якщо ті самі чати
+    обслуговують кілька незалежних процесів, кеш вимикається через cache_ttl=0.
+    """
+
+    def __init__(self, session_factory, ttl: float, cache_size: int = 10000, cache_ttl: float = 0):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        # Запис кешу: (стан, дані, expires_at рядка або None, якщо рядка немає)
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_ttl > 0 else None
+
+    async def _load(self, key: str) -> tuple[str | None, dict]:
+        if self._cache is not None:
+            cached = self._cache.get(key)
+            if cached is not None:
+                expires_at = cached[2]
+                if expires_at is not None and expires_at <= datetime.now(timezone.utc):
+                    return None, {}
+                return cached[0], cached[1]
+
+        async with self.session_factory() as session:
+            row = await session.get(FSMState, key)
+        entry = (None, {}, None)
+        if row is not None and not self._expired(row):
+            try:
+                data = json.loads(decrypt_key(row.data)) if row.data else {}
+            except InvalidToken:
+                # Дані зашифровані ключем, якого вже немає після ротації — сценарій починається заново.
+                # Такий рядок не кешується: після запису стану кеш розійшовся б із БД
+                logger.warning(f"FSM data for {key} cannot be decrypted, treating it as empty")
+                return None, {}
+            entry = (row.state, data, self._aware(row.expires_at))
+        if self._cache is not None:
+            self._cache.set(key, entry)
+        return entry[0], entry[1]
+
+    def _remember(self, key: str, column: str, value: Any, now: datetime, expires_at: datetime):
+        """Повторює в кеші те, що щойно зробив _write у БД, за тими самими правилами."""
+        if self._cache is None:
+            return
+        cached = self._cache.get(key)
+        if cached is None:
+            return
+        state, data, cached_expires = cached
+        if cached_expires is None or cached_expires <= now:
+            state, data = None, {}
+        if column == "state":
+            state = value
+        else:
+            data = value
+        self._cache.set(key, (state, data, expires_at) if state is not None or data else (None, {}, None))
+
+    async def _write(self, key: str, column: str, value: str | None) -> tuple[datetime, datetime]:
+        """Оновлює одну колонку одним UPDATE, тож паралельний запис іншої колонки не губиться.
+
+        Повертає (момент запису, новий expires_at) для _remember."""
+        table = FSMState.__table__
+        other = "data" if column == "state" else "state"
+        now = datetime.now(timezone.utc)
+        values = {
+            column: value,
+            # Протермінований рядок — порожній сценарій: друга колонка теж скидається
+            other: case((table.c.expires_at <= now, None), else_=table.c[other]),
+            "expires_at": now + timedelta(seconds=self.ttl),
+        }
+        stmt = update(table).where(table.c.key == key).values(values)
+
+        async with self.session_factory() as session:
+            result = await session.execute(stmt)
+            if not result.rowcount and value is not None:
+                try:
+                    await session.execute(insert(table).values(
+                        key=key, **{column: value}, expires_at=values["expires_at"],
+                    ))
+                    await session.commit()
+                except IntegrityError:
+                    # Інший процес щойно створив рядок — оновлюємо його
+                    await session.rollback()
+                    await session.execute(stmt)
+            if value is None:
+                await session.execute(
+                    delete(table).where(table.c.key == key, table.c.state.is_(None), table.c.data.is_(None))
+                )
+            await session.commit()
+        return now, values["expires_at"]
+
+    @staticmethod
+    def _aware(expires_at: datetime) -> datetime:
+        # SQLite повертає дату без часової зони — вона завжди збережена в UTC
+        return expires_at.replace(tzinfo=timezone.utc) if expires_at.tzinfo is None else expires_at
+
+    @classmethod
+    def _expired(cls, row: FSMState) -> bool:
+        return cls._aware(row.expires_at) <= datetime.now(timezone.utc)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        row_key = _row_key(key)
+        state = state.state if isinstance(state, State) else state
+        now, expires_at = await self._write(row_key, "state", state)
+        self._remember(row_key, "state", state, now, expires_at)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._load(_row_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        row_key = _row_key(key)
+        data = copy.deepcopy(dict(data))
+        encrypted = encrypt_key(json.dumps(data, separators=(",", ":"))) if data else None
+        now, expires_at = await self._write(row_key, "data", encrypted)
+        self._remember(row_key, "data", data, now, expires_at)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._load(_row_key(key))
+        return copy.deepcopy(data)
+
+    async def purge_expired(self) -> int:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                delete(FSMState).where(FSMState.expires_at <= datetime.now(timezone.utc))
+            )
+            await session.commit()
+        return result.rowcount
+
+    async def run_cleanup(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await self.purge_expired()
+                if removed:
+                    logger.info(f"Removed {removed} abandoned FSM states")
+            except Exception as e:
+                logger.warning(f"FSM cleanup failed: {e}")
+
+    async def close(self) -> None:
+        if self._cache is not None:
+            self._cache.clear()
@@ -0,0 +1,150 @@
+import asyncio
+import hmac
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Приймає оновлення від Telegram по HTTP і обробляє їх обмеженим пулом воркерів."""
+
+    def __init__(self, bot: Bot, dp: Dispatcher, path: str, secret: str | None, workers: int, queue_size: int):
+        self.bot = bot
+        self.dp = dp
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self._queue: asyncio.Queue[Update] = asyncio.Queue(maxsize=queue_size)
+        self._tasks: list[asyncio.Task] = []
+        self._accepting = False
+
+        self.received = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.router.add_get("/healthz", self.health)
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._on_shutdown)
+        return app
+
+    async def _on_startup(self, app: web.Application):
+        self.start()
+
+    async def _on_shutdown(self, app: web.Application):
+        await self.drain()
+
+    def start(self):
+        self._accepting = True
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        if not self._accepting:
+            # Не 200: Telegram повторить доставку вже на інший (або перезапущений) інстанс
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logger.warning(f"Rejected malformed update: {e}")
+            return web.Response(status=400)
+
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(status=503)
+
+        self.received += 1
+        return web.Response()
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "accepting": self._accepting,
+            "queued": self._queue.qsize(),
+            "received": self.received,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        })
+
+    async def _worker(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                self.failed += 1
+                logger.exception(f"Update {update.update_id} failed")
+            finally:
+                self._queue.task_done()
+
+    async def drain(self, timeout: float | None = None):
+        """Перестає приймати нові оновлення, дочікується вже прийнятих і зупиняє воркерів."""
+        self._accepting = False
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutdown timeout: {self._queue.qsize()} updates left unprocessed")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def check_webhook_secret(settings):
+    """Без секрету публічний ендпоінт приймає підроблені оновлення від будь-кого."""
+    if settings.WEBHOOK_SECRET:
+        return
+    if settings.WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_SECRET must be set when the webhook is registered via WEBHOOK_URL")
+    logger.warning(
+        "WEBHOOK_SECRET is not set: the webhook endpoint accepts updates from anyone. "
+        "Only run it like this behind a proxy that authenticates Telegram."
+    )
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, settings, stop: asyncio.Event):
+    check_webhook_secret(settings)
+    server = WebhookServer(
+        bot, dp,
+        path=settings.WEBHOOK_PATH,
+        secret=settings.WEBHOOK_SECRET,
+        workers=settings.WEBHOOK_WORKERS,
+        queue_size=settings.WEBHOOK_QUEUE_SIZE,
+    )
+    app = server.build_app()
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.WEBHOOK_HOST, settings.WEBHOOK_PORT)
+    await site.start()
+
+    if settings.WEBHOOK_URL:
+        await bot.set_webhook(
+            settings.WEBHOOK_URL.rstrip("/") + settings.WEBHOOK_PATH,
+            secret_token=settings.WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=settings.WEBHOOK_WORKERS,
+        )
+    logger.info(f"Webhook server listening on {settings.WEBHOOK_HOST}:{settings.WEBHOOK_PORT}{settings.WEBHOOK_PATH}")
+
+    try:
+        await stop.wait()
+    finally:
+        # Спершу доробляємо прийняті оновлення, потім закриваємо сокет
+        await server.drain(settings.SHUTDOWN_TIMEOUT)
+        await runner.cleanup()
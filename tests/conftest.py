@@ -1,14 +1,37 @@
 import pytest
 import pytest_asyncio
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
 from app.database import Base
+from app.services.ticker_cache import ticker_cache
+from app.services.circuit_breaker import circuit_breakers
+from app.services import portfolio_service
+from app.security import credentials
+from app.services.ai_service import answer_cache
+from app.repositories.cached_user_repo import user_cache
 
 
 TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
+@pytest.fixture(autouse=True)
+def reset_shared_caches():
+    ticker_cache.clear()
+    circuit_breakers.clear()
+    portfolio_service._recent.clear()
+    credentials.clear()
+    answer_cache.clear()
+    user_cache.clear()
+    yield
+    ticker_cache.clear()
+    circuit_breakers.clear()
+    portfolio_service._recent.clear()
+    credentials.clear()
+    answer_cache.clear()
+    user_cache.clear()
+
 @pytest_asyncio.fixture(scope="function")
 async def db_session():
     engine = create_async_engine(
@@ -16,6 +39,11 @@ async def db_session():
         connect_args={"check_same_thread": False}, 
         poolclass=StaticPool 
     )
+
+    # SQLite без цього ігнорує ON DELETE CASCADE, на який покладається репозиторій
+    @event.listens_for(engine.sync_engine, "connect")
+    def _enable_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
     
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
@@ -0,0 +1,25 @@
+"""Легкі воркери для тестів ShardRouter: spawn імпортує модуль цілі в дочірньому процесі."""
+import asyncio
+import os
+import time
+
+
+def file_writer_worker(index, updates):
+    # Кожне оновлення — файл із pid процесу, що його обробив
+    while (data := updates.get()) is not None:
+        with open(data["path"], "w") as f:
+            f.write(str(os.getpid()))
+
+
+def stuck_worker(index, updates):
+    time.sleep(60)
+
+
+def slow_worker(index, updates):
+    # Справжній цикл воркера з обробником, що ніколи не завершується
+    from bot.sharding import OrderedExecutor, consume_updates
+
+    async def main():
+        await consume_updates(updates, OrderedExecutor(1), max_pending=1, handle=lambda data: asyncio.sleep(60))
+
+    asyncio.run(main())
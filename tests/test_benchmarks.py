@@ -0,0 +1,52 @@
+import os
+import pytest
+
+from app.services.market_store import market_store
+from benchmarks import e2e, replay
+
+
+def _snapshot_mtime():
+    return os.path.getmtime(market_store.path) if os.path.exists(market_store.path) else None
+
+
+@pytest.mark.asyncio
+async def test_e2e_benchmark_runs_offline():
+    snapshot_before = _snapshot_mtime()
+    args = e2e.parse_args([
+        "--users", "4", "--accounts", "2", "--concurrency", "4",
+        "--exchange-latency", "0", "--exchange-jitter", "0", "--telegram-latency", "0",
+        "--ai-first-token", "0", "--ai-chunk-delay", "0", "--ai-chunks", "2",
+    ])
+    report = await e2e.main(args)
+
+    assert set(report["flows"]) == set(e2e.FLOWS)
+    for flow in report["flows"].values():
+        assert flow["count"] == 4
+        assert flow["errors"] == {}
+        assert flow["p50_ms"] <= flow["p95_ms"] <= flow["p99_ms"]
+    assert report["exchange_calls"]["fetch_balance"] == 8
+    assert report["ai_calls"] == 4
+    # Вигадані ринки не потрапили ні в бойовий знімок, ні в пам'ять процесу
+    assert _snapshot_mtime() == snapshot_before
+    assert market_store.get("binance", False) is None
+
+
+@pytest.mark.asyncio
+async def test_replay_records_and_replays_stream(tmp_path):
+    common = [
+        "--url", f"sqlite+aiosqlite:///{tmp_path / 'bench.db'}", "--users", "5", "--accounts", "1",
+        "--rate", "200", "--sample-interval", "0.05",
+        "--exchange-latency", "0", "--exchange-jitter", "0", "--telegram-latency", "0",
+        "--ai-first-token", "0", "--ai-chunk-delay", "0", "--ai-chunks", "1",
+    ]
+    recorded = tmp_path / "traffic.jsonl"
+    report = await replay.main(replay.parse_args([*common, "--limit", "40", "--record", str(recorded)]))
+
+    assert report["submitted"] == report["processed"] == 40
+    assert report["errors"] == {}
+    assert len(recorded.read_text(encoding="utf-8").splitlines()) == 40
+    assert sum(stats["count"] for stats in report["handler_latency"].values()) == 40
+
+    again = await replay.main(replay.parse_args([*common, "--input", str(recorded)]))
+    assert again["processed"] == 40
+    assert again["handler_latency"].keys() == report["handler_latency"].keys()
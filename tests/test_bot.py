@@ -0,0 +1,311 @@
+import asyncio
+import os
+import signal
+import time
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+from aiohttp.test_utils import TestClient, TestServer
+
+from bot.progress import ThrottledEditor, close_markdown
+from bot.webhook import WebhookServer, SECRET_HEADER, check_webhook_secret
+from bot.storage import SQLAlchemyStorage
+from bot.sharding import OrderedExecutor, ShardRouter, shard_for
+from tests import shard_workers
+from bot.states import AddExchange
+from aiogram.fsm.storage.base import StorageKey
+from cryptography.fernet import Fernet
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from app.database import Base, instrument_engine, query_stats
+from bot.middlewares import DbSessionMiddleware
+from app.models import FSMState
+
+
+def test_close_markdown_balances_open_entities():
+    assert close_markdown("**BTC** виглядає _стабільно") == "**BTC** виглядає _стабільно_"
+    assert close_markdown("Ціна `50000") == "Ціна `50000`"
+    assert close_markdown("```\ncode") == "```\ncode\n```"
+    assert close_markdown("**готово**") == "**готово**"
+
+
+@pytest.mark.asyncio
+async def test_throttled_editor_skips_edits_within_interval():
+    message = AsyncMock()
+    editor = ThrottledEditor(message, min_interval=60)
+
+    await editor.update("1")
+    await editor.update("2")
+    await editor.flush("3")
+
+    assert [call.args[0] for call in message.edit_text.await_args_list] == ["1", "3"]
+
+
+def _recorded_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 1700000000, "text": "/balance",
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Test"}
+        }
+    }
+
+
+def test_webhook_refuses_to_start_without_secret(caplog):
+    with pytest.raises(RuntimeError):
+        check_webhook_secret(SimpleNamespace(WEBHOOK_URL="https://bot.example.com", WEBHOOK_SECRET=None))
+
+    check_webhook_secret(SimpleNamespace(WEBHOOK_URL="https://bot.example.com", WEBHOOK_SECRET="s3cret"))
+    # Без WEBHOOK_URL (вебхук реєструє проксі) — лише гучне попередження
+    check_webhook_secret(SimpleNamespace(WEBHOOK_URL=None, WEBHOOK_SECRET=""))
+    assert "WEBHOOK_SECRET is not set" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_webhook_validates_secret_and_drains_updates():
+    processed = []
+
+    async def feed_update(bot, update):
+        await asyncio.sleep(0.01)
+        processed.append(update.update_id)
+
+    dp = MagicMock()
+    dp.feed_update = feed_update
+    server = WebhookServer(MagicMock(), dp, path="/hook", secret="s3cret", workers=2, queue_size=10)
+
+    async with TestClient(TestServer(server.build_app())) as client:
+        resp = await client.post("/hook", json=_recorded_update(1), headers={SECRET_HEADER: "wrong"})
+        assert resp.status == 401
+
+        for update_id in range(1, 6):
+            resp = await client.post("/hook", json=_recorded_update(update_id), headers={SECRET_HEADER: "s3cret"})
+            assert resp.status == 200
+
+        await server.drain(timeout=5)
+        resp = await client.post("/hook", json=_recorded_update(6), headers={SECRET_HEADER: "s3cret"})
+        assert resp.status == 503
+
+    assert sorted(processed) == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.asyncio
+async def test_sqlalchemy_storage_shares_state_and_expires(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'fsm.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+    key = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+    first = SQLAlchemyStorage(factory, ttl=60)
+    await first.set_state(key, AddExchange.waiting_for_secret)
+    await first.update_data(key, {"name": "binance", "key": "plain-api-key"})
+
+    # Інший процес бачить той самий стан
+    second = SQLAlchemyStorage(factory, ttl=60)
+    assert await second.get_state(key) == AddExchange.waiting_for_secret.state
+    assert await second.get_data(key) == {"name": "binance", "key": "plain-api-key"}
+
+    async with factory() as session:
+        row = (await session.execute(select(FSMState))).scalar_one()
+    assert "plain-api-key" not in row.data
+
+    await second.set_state(key, None)
+    await second.set_data(key, {})
+    async with factory() as session:
+        assert (await session.execute(select(FSMState))).first() is None
+
+    expiring = SQLAlchemyStorage(factory, ttl=-1)
+    await expiring.set_state(key, AddExchange.waiting_for_name)
+    assert await SQLAlchemyStorage(factory, ttl=60).get_state(key) is None
+
+    assert await expiring.purge_expired() == 1
+
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_sqlalchemy_storage_processes_do_not_overwrite_each_other(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'fsm.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+    key = StorageKey(bot_id=1, chat_id=10, user_id=10)
+    first, second = SQLAlchemyStorage(factory, ttl=60), SQLAlchemyStorage(factory, ttl=60)
+
+    await first.set_state(key, AddExchange.waiting_for_name)
+    assert await second.get_state(key) == AddExchange.waiting_for_name.state
+
+    # Кожен процес пише свою колонку — чужий запис не затирається
+    await second.set_data(key, {"name": "okx"})
+    await first.set_state(key, AddExchange.waiting_for_key)
+    assert await second.get_state(key) == AddExchange.waiting_for_key.state
+    assert await first.get_data(key) == {"name": "okx"}
+
+    # Дані, зашифровані ключем, якого вже немає, — порожній сценарій, а не InvalidToken
+    async with factory() as session:
+        row = await session.get(FSMState, "1:10:10:::default")
+        row.data = Fernet(Fernet.generate_key()).encrypt(b"{}").decode()
+        await session.commit()
+    assert await second.get_data(key) == {}
+    assert await second.get_state(key) is None
+
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_sqlalchemy_storage_cache_serves_reads_and_follows_writes(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'fsm.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    factory = MagicMock(side_effect=async_sessionmaker(engine, expire_on_commit=False))
+    key = StorageKey(bot_id=1, chat_id=10, user_id=10)
+    storage = SQLAlchemyStorage(factory, ttl=60, cache_size=100, cache_ttl=60)
+
+    # FSMContextMiddleware читає стан на кожне оновлення — з кешу це без сесії БД
+    assert await storage.get_state(key) is None
+    assert await storage.get_data(key) == {}
+    assert factory.call_count == 1
+
+    await storage.set_state(key, AddExchange.waiting_for_name)
+    await storage.update_data(key, {"name": "okx"})
+    writes = factory.call_count
+    assert await storage.get_state(key) == AddExchange.waiting_for_name.state
+    assert await storage.get_data(key) == {"name": "okx"}
+    assert factory.call_count == writes
+
+    # Кеш збігається з БД
+    uncached = SQLAlchemyStorage(async_sessionmaker(engine), ttl=60)
+    assert await uncached.get_state(key) == AddExchange.waiting_for_name.state
+    assert await uncached.get_data(key) == {"name": "okx"}
+
+    await storage.set_state(key, None)
+    await storage.set_data(key, {})
+    assert await storage.get_state(key) is None
+    async with async_sessionmaker(engine)() as session:
+        assert (await session.execute(select(FSMState))).first() is None
+
+    # Протермінований сценарій не віддається з кешу
+    expiring = SQLAlchemyStorage(factory, ttl=-1, cache_size=100, cache_ttl=60)
+    assert await expiring.get_state(key) is None
+    await expiring.set_state(key, AddExchange.waiting_for_name)
+    assert await expiring.get_state(key) is None
+
+    await engine.dispose()
+
+
+def test_shard_for_routes_by_user_id():
+    message = _recorded_update(1)
+    callback = {"update_id": 2, "callback_query": {"id": "q", "from": {"id": 1}, "chat_instance": "c"}}
+    other_user = {"update_id": 3, "message": {**message["message"], "from": {"id": 2}}}
+
+    assert shard_for(message, 4) == shard_for(callback, 4) == 1
+    assert shard_for(other_user, 4) == 2
+
+
+async def _wait_for(predicate, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.05)
+
+
+@pytest.mark.asyncio
+async def test_shard_router_restarts_killed_worker_with_fresh_queue(tmp_path):
+    router = ShardRouter(1, queue_size=10, restart_delay=0.05, worker=shard_workers.file_writer_worker)
+    router.start()
+    supervisor = asyncio.create_task(router.supervise())
+    try:
+        first = tmp_path / "first"
+        assert await router.route({"update_id": 1, "path": str(first)})
+        await _wait_for(first.exists)
+
+        # Убитий посеред updates.get() воркер лишає захопленим lock читача своєї черги
+        killed = router._processes[0]
+        os.kill(killed.pid, signal.SIGKILL)
+        await _wait_for(lambda: router.restarts == 1)
+
+        second = tmp_path / "second"
+        assert await router.route({"update_id": 2, "path": str(second)})
+        await _wait_for(second.exists)
+        assert second.read_text() != str(killed.pid)
+    finally:
+        supervisor.cancel()
+        await router.stop(timeout=5)
+
+
+@pytest.mark.asyncio
+async def test_shard_router_drops_update_instead_of_blocking():
+    router = ShardRouter(1, queue_size=1, route_timeout=0.1, worker=shard_workers.stuck_worker)
+    router.start()
+    try:
+        assert await router.route({"update_id": 1})
+        assert not await router.route({"update_id": 2})
+        assert router.dropped == 1
+    finally:
+        await router.stop(timeout=0.1)
+
+
+@pytest.mark.asyncio
+async def test_slow_worker_back_pressures_route():
+    router = ShardRouter(1, queue_size=1, route_timeout=0.1, worker=shard_workers.slow_worker)
+    router.start()
+    try:
+        assert await router.route({"update_id": 1})
+        # Воркер забрав перше оновлення й обробляє його
+        await _wait_for(lambda: router._queues[0].qsize() == 0, timeout=10)
+        assert await router.route({"update_id": 2})
+        await asyncio.sleep(0.3)
+
+        # Друге лишилося в черзі: воркер не бере нових, поки не звільнить дозвіл
+        assert not await router.route({"update_id": 3})
+        assert router.dropped == 1
+    finally:
+        await router.stop(timeout=0.1)
+
+
+@pytest.mark.asyncio
+async def test_ordered_executor_keeps_per_user_order():
+    executor = OrderedExecutor(concurrency=4)
+    events = []
+
+    async def handle(user_id, n, delay):
+        await asyncio.sleep(delay)
+        events.append((user_id, n))
+
+    executor.submit(1, lambda: handle(1, 1, 0.03))
+    executor.submit(2, lambda: handle(2, 1, 0.0))
+    executor.submit(1, lambda: handle(1, 2, 0.0))
+    await executor.join()
+
+    # Користувач 2 не чекає на користувача 1, а події користувача 1 не переставляються
+    assert events == [(2, 1), (1, 1), (1, 2)]
+
+
+@pytest.mark.asyncio
+async def test_db_middleware_takes_connection_lazily_and_counts_queries(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'bot.db'}")
+    instrument_engine(engine)
+    middleware = DbSessionMiddleware(async_sessionmaker(engine), slow_update_seconds=0)
+    seen = {}
+
+    async def no_db_handler(event, data):
+        assert isinstance(data["session"], AsyncSession)
+        return "ok"
+
+    async def db_handler(event, data):
+        await data["session"].execute(select(1))
+        await data["session"].execute(select(2))
+        seen["queries"] = query_stats.get().queries
+        seen["checked_out"] = engine.pool.checkedout()
+
+    assert await middleware(no_db_handler, MagicMock(), {}) == "ok"
+    # Хендлер без запитів не забирає з'єднання з пулу
+    assert engine.pool.checkedout() == 0 and engine.pool.checkedin() == 0
+
+    await middleware(db_handler, MagicMock(), {})
+    assert seen == {"queries": 2, "checked_out": 1}
+    assert engine.pool.checkedout() == 0
+    assert query_stats.get() is None
+
+    await engine.dispose()
@@ -0,0 +1,68 @@
+import pytest
+from unittest.mock import MagicMock
+from aiohttp.test_utils import TestClient, TestServer
+from ccxt.base.errors import AuthenticationError
+
+from app.metrics import Registry, build_metrics_app, exchange_errors_total, exchange_request_seconds, observe_exchange_call
+from bot.handlers import router  # noqa: F401 — створює серії бірж і хендлерів
+from bot.webhook import WebhookServer
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    latency = registry.histogram("op_seconds", "Op latency", ("op",), buckets=(0.1, 1.0))
+    calls = registry.counter("calls_total", "Calls")
+    series = latency.labels('say "hi"')
+
+    for value in (0.05, 0.5, 0.5, 3.0):
+        series.observe(value)
+    calls.inc(2)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE op_seconds histogram" in lines
+    assert 'op_seconds_bucket{op="say \\"hi\\"",le="0.1"} 1' in lines
+    assert 'op_seconds_bucket{op="say \\"hi\\"",le="1"} 3' in lines
+    assert 'op_seconds_bucket{op="say \\"hi\\"",le="+Inf"} 4' in lines
+    assert 'op_seconds_count{op="say \\"hi\\""} 4' in lines
+    assert 'op_seconds_sum{op="say \\"hi\\""} 4.05' in lines
+    assert "calls_total 2" in lines
+    # Серія кешується: повторний виклик labels повертає той самий об'єкт
+    assert latency.labels('say "hi"') is series
+
+
+@pytest.mark.asyncio
+async def test_exchange_calls_are_exposed_on_metrics_endpoint():
+    async def fail():
+        raise AuthenticationError("bad key")
+
+    async def ok():
+        return {"total": {}}
+
+    errors = exchange_errors_total.labels("okx", "fetch_balance", "AuthenticationError")
+    errors_before = errors.value
+    count_before = sum(exchange_request_seconds.labels("okx", "fetch_balance").counts)
+
+    assert await observe_exchange_call("okx", "fetch_balance", ok()) == {"total": {}}
+    with pytest.raises(AuthenticationError):
+        await observe_exchange_call("okx", "fetch_balance", fail())
+
+    assert errors.value == errors_before + 1
+    assert sum(exchange_request_seconds.labels("okx", "fetch_balance").counts) == count_before + 2
+
+    # Публічний порт webhook метрик не віддає
+    server = WebhookServer(MagicMock(), MagicMock(), path="/hook", secret="s3cret", workers=1, queue_size=1)
+    async with TestClient(TestServer(server.build_app())) as client:
+        assert (await client.get("/metrics")).status == 404
+
+    async with TestClient(TestServer(build_metrics_app())) as client:
+        resp = await client.get("/metrics")
+        assert resp.status == 200
+        assert resp.headers["Content-Type"].startswith("text/plain")
+        body = await resp.text()
+
+    assert f'exchange_errors_total{{exchange="okx",method="fetch_balance",error="AuthenticationError"}} {int(errors.value)}' in body
+    assert 'exchange_request_seconds_bucket{exchange="binance",method="fetch_tickers",le="+Inf"}' in body
+    assert 'telegram_handler_seconds_count{handler="handle_balance"}' in body
+    # Gauges черги Gemini оновлюються зі стану AIDispatcher під час експорту
+    assert "ai_queue_queued 0" in body.splitlines()
+    assert "# TYPE ai_queue_wait_max_seconds gauge" in body
@@ -1,6 +1,9 @@
 import pytest
 from app.repositories.user_repo import UserRepository
+from app.repositories.snapshot_repo import SnapshotRepository
+from unittest.mock import patch
 from app.models import User, ExchangeAccount
+from app.repositories.cached_user_repo import CachedUserRepository, LocalCacheBackend, RedisCacheBackend
 
 @pytest.mark.asyncio
 async def test_create_user_if_not_exists(db_session):
@@ -45,4 +48,95 @@ async def test_delete_account(db_session):
     assert result is True
     
     accounts = await repo.get_user_accounts(99)
-    assert len(accounts) == 0
\ No newline at end of file
+    assert len(accounts) == 0
+
+
+@pytest.mark.asyncio
+async def test_snapshot_save_and_owner_batches(db_session):
+    repo = UserRepository(db_session)
+    snapshots = SnapshotRepository(db_session)
+    for user_id in (1, 2, 3):
+        await repo.create_user_if_not_exists(user_id, f"user{user_id}")
+        await repo.add_account(user_id, "binance", "k", "s", None, False)
+
+    assert await repo.get_owner_ids_after(0, 2) == [1, 2]
+    assert await repo.get_owner_ids_after(2, 2) == [3]
+
+    await snapshots.save(1, {"BINANCE (Real)": {"USDT": {"amount": 5, "usd_val": 5}}}, [])
+    snapshot = await snapshots.get_latest(1)
+    assert snapshot.data["BINANCE (Real)"]["USDT"]["usd_val"] == 5
+    assert 0 <= SnapshotRepository.age_seconds(snapshot) < 60
+
+    await repo.delete_all_user_data(1)
+    assert await snapshots.get_latest(1) is None
+
+
+@pytest.mark.asyncio
+async def test_cached_user_repository_reads_through_and_invalidates(db_session):
+    cache = LocalCacheBackend(maxsize=100, ttl=60)
+    repo = CachedUserRepository(db_session, cache)
+    await repo.create_user_if_not_exists(7, "cached")
+    await repo.add_account(7, "okx", "k", "s", None, False)
+
+    accounts = await repo.get_user_accounts(7)
+    assert [a.exchange_name for a in accounts] == ["okx"]
+
+    # Повторне читання не йде в БД
+    with patch.object(UserRepository, "get_user_accounts", side_effect=AssertionError):
+        assert await repo.get_user_accounts(7) == accounts
+        assert (await repo.create_user_if_not_exists(7, "other")).username == "cached"
+
+    await repo.add_account(7, "bybit", "k2", "s2", None, True)
+    assert {a.exchange_name for a in await repo.get_user_accounts(7)} == {"okx", "bybit"}
+
+    assert await repo.delete_account(accounts[0].id, 7)
+    assert [a.exchange_name for a in await repo.get_user_accounts(7)] == ["bybit"]
+
+    await repo.delete_all_user_data(7)
+    assert await repo.get_user_accounts(7) == []
+    assert await cache.get("user:7") is None
+
+
+@pytest.mark.asyncio
+async def test_redis_cache_backend_shares_entries_between_processes(db_session):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    # Два бекенди на одному сервері — як два процеси бота
+    first = RedisCacheBackend("redis://localhost", ttl=60, client=fakeredis.FakeAsyncRedis(server=server))
+    second = RedisCacheBackend("redis://localhost", ttl=60, client=fakeredis.FakeAsyncRedis(server=server))
+
+    repo = CachedUserRepository(db_session, first)
+    await repo.create_user_if_not_exists(7, "cached")
+    await repo.add_account(7, "okx", "k", "s", None, False)
+    accounts = await repo.get_user_accounts(7)
+
+    with patch.object(UserRepository, "get_user_accounts", side_effect=AssertionError):
+        assert await CachedUserRepository(db_session, second).get_user_accounts(7) == accounts
+    assert 0 < await second._redis.ttl("cv:accounts:7") <= 60
+
+    await second.delete_prefix("accounts:")
+    assert await first.get("accounts:7") is None
+    assert await first.get("user:7") == [7, "cached"]
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_and_single_statement_deletes(db_session):
+    repo = UserRepository(db_session)
+    await repo.create_user_if_not_exists(5, "bulk")
+    await repo.create_user_if_not_exists(6, "other")
+
+    rows = [
+        {"owner_id": 5, "exchange_name": name, "api_key": "k", "api_secret": "s", "is_demo": False}
+        for name in ("binance", "okx", "bybit")
+    ]
+    assert await repo.add_accounts(rows) == 3
+    accounts = await repo.get_user_accounts(5)
+    assert len(accounts) == 3
+
+    # Чужу біржу видалити не можна
+    assert await repo.delete_account(accounts[0].id, 6) is False
+    assert await repo.delete_account(accounts[0].id, 5) is True
+
+    await repo.delete_all_user_data(5)
+    assert await repo.get_user_accounts(5) == []
+    assert await db_session.get(User, 5) is None
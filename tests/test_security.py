@@ -1,5 +1,12 @@
+import pytest
+from unittest.mock import patch
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from cryptography.fernet import Fernet
-from app.security import encrypt_key, decrypt_key
+from app.security import encrypt_key, decrypt_key, build_cipher, Credentials, CredentialProvider
+from app.models import ExchangeAccount
+from app.key_rotation import rotate_encryption_keys
+from app.repositories.cached_user_repo import LocalCacheBackend
 
 def test_encryption_decryption_cycle():
 
@@ -9,4 +16,95 @@ def test_encryption_decryption_cycle():
     decrypted = decrypt_key(encrypted, ciper)
 
     assert decrypted == original_api_key
-    assert encrypted != original_api_key
\ No newline at end of file
+    assert encrypted != original_api_key
+
+
+def test_multifernet_decrypts_with_previous_key():
+    old_key, new_key = Fernet.generate_key().decode(), Fernet.generate_key().decode()
+    encrypted = encrypt_key("secret", build_cipher(old_key))
+
+    rotated = build_cipher(f"{new_key},{old_key}")
+    assert decrypt_key(encrypted, rotated) == "secret"
+
+
+def test_credential_provider_caches_and_invalidates():
+    account = ExchangeAccount(id=1, api_key=encrypt_key("key"), api_secret=encrypt_key("sec"), api_passphrase=None)
+    provider = CredentialProvider(maxsize=10, ttl=60)
+
+    with patch("app.security.decrypt_key", wraps=decrypt_key) as spy:
+        creds = provider.get_many([account])[1]
+        assert creds == Credentials("key", "sec", None)
+        provider.get(account)
+        assert spy.call_count == 3
+
+        provider.invalidate(1)
+        provider.get(account)
+        assert spy.call_count == 6
+
+
+@pytest.mark.asyncio
+async def test_rotate_encryption_keys_reencrypts_in_batches(db_session, tmp_path):
+    old_key, new_key = Fernet(Fernet.generate_key()), Fernet(Fernet.generate_key())
+    for i in range(5):
+        db_session.add(ExchangeAccount(
+            exchange_name="binance",
+            api_key=encrypt_key(f"key{i}", old_key),
+            api_secret=encrypt_key(f"secret{i}", old_key),
+            api_passphrase=None
+        ))
+    await db_session.commit()
+
+    session_factory = async_sessionmaker(db_session.bind, expire_on_commit=False)
+    checkpoint = str(tmp_path / "rotation.checkpoint")
+    cache = LocalCacheBackend(maxsize=10, ttl=60)
+    await cache.set("accounts:1", [[1, "binance", "old-token", "old-token", None, False, 1]])
+    await cache.set("user:1", [1, "user"])
+    stats = await rotate_encryption_keys(
+        session_factory, [new_key, old_key], batch_size=2, checkpoint_path=checkpoint, cache=cache,
+    )
+
+    assert stats["scanned"] == 5
+    # Закешовані біржі зі старими шифротекстами видалено, решта кешу ціла
+    assert await cache.get("accounts:1") is None
+    assert await cache.get("user:1") == [1, "user"]
+    assert stats["rotated"] == 5
+
+    accounts = (await db_session.execute(select(ExchangeAccount).execution_options(populate_existing=True))).scalars().all()
+    assert sorted(decrypt_key(acc.api_key, new_key) for acc in accounts) == [f"key{i}" for i in range(5)]
+    assert all(acc.api_passphrase is None for acc in accounts)
+
+    # Повторний запуск нічого не перешифровує
+    stats = await rotate_encryption_keys(session_factory, [new_key, old_key], batch_size=2, checkpoint_path=checkpoint)
+    assert stats["rotated"] == 0
+
+
+@pytest.mark.asyncio
+async def test_rotate_encryption_keys_resumes_from_checkpoint_and_skips_unreadable_rows(db_session, tmp_path):
+    old_key, new_key, lost_key = (Fernet(Fernet.generate_key()) for _ in range(3))
+    accounts = [
+        ExchangeAccount(exchange_name="binance", api_key=encrypt_key(f"key{i}", lost_key if i == 3 else old_key),
+                        api_secret=encrypt_key(f"secret{i}", old_key), api_passphrase=None)
+        for i in range(5)
+    ]
+    db_session.add_all(accounts)
+    await db_session.commit()
+    ids = [acc.id for acc in accounts]
+
+    # Перерваний запуск встиг обробити першу пачку з двох рядків
+    checkpoint = tmp_path / "rotation.checkpoint"
+    checkpoint.write_text(str(ids[1]))
+    session_factory = async_sessionmaker(db_session.bind, expire_on_commit=False)
+    stats = await rotate_encryption_keys(session_factory, [new_key, old_key], batch_size=2, checkpoint_path=str(checkpoint))
+
+    # Рядок, який не розшифровує жоден ключ, не зупиняє ротацію
+    assert stats["scanned"] == 3
+    assert stats["rotated"] == 2
+    assert stats["failed_ids"] == [ids[3]]
+    assert not checkpoint.exists()
+
+    rows = (await db_session.execute(
+        select(ExchangeAccount).order_by(ExchangeAccount.id).execution_options(populate_existing=True)
+    )).scalars().all()
+    assert decrypt_key(rows[0].api_key, old_key) == "key0"
+    assert decrypt_key(rows[2].api_key, new_key) == "key2"
+    assert decrypt_key(rows[4].api_key, new_key) == "key4"
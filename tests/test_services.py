@@ -1,18 +1,41 @@
 import pytest
 import asyncio
+import time
 from unittest.mock import AsyncMock, patch, MagicMock
 from app.services.crypto_service import CryptoService
 from app.services.portfolio_service import PortfolioService
+from app.services.exchange_pool import ExchangePool
+from app.services.ticker_cache import TickerCache
+from app.services.market_store import MarketStore
+from app.services.circuit_breaker import CircuitBreaker, circuit_breakers
+from app.services.crypto_service import last_known_balances
+from app.services.scheduler import ExchangeLimits, ExchangeScheduler
+from app.metrics import export_scheduler_stats, registry
+from app.services.ai_queue import AIDispatcher, AIRateLimited, retry_on_quota
+from app.services.analytics import PortfolioAnalytics
+from app.services.market_store import MarketIndex
+from app.services.ai_service import stream_gemini_advice, get_gemini_advice, portfolio_fingerprint, answer_cache
+from google.api_core.exceptions import ResourceExhausted
 from app.models import ExchangeAccount
+from app.repositories.user_repo import UserRepository
+from app.repositories.snapshot_repo import SnapshotRepository
+
+BTC_USDT_MARKET = {
+    'symbol': 'BTC/USDT', 'base': 'BTC', 'quote': 'USDT', 'spot': True, 'active': True,
+    'precision': {'amount': 0.00001, 'price': 0.01}, 'info': {'raw': 'payload'}
+}
 
 # --- Тест CryptoService ---
 
 @pytest.mark.asyncio
-async def test_crypto_service_get_balance():
-    with patch("app.services.crypto_service.ccxt") as mock_ccxt:
-        with patch("app.services.crypto_service.decrypt_key", side_effect=lambda x: x):
+async def test_crypto_service_get_balance(tmp_path):
+    with patch("app.services.crypto_service.ccxt") as mock_ccxt, \
+         patch("app.services.crypto_service.market_store", MarketStore(str(tmp_path / "markets.json"), 3600)):
+        with patch("app.security.decrypt_key", side_effect=lambda x: x):
             
             mock_exchange = AsyncMock()
+            mock_exchange.markets = {'BTC/USDT': BTC_USDT_MARKET}
+            mock_exchange.currencies = {}
             mock_exchange.fetch_balance.return_value = {
                 'total': {'BTC': 1.0, 'USDT': 100.0, 'XRP': 0.0}
             }
@@ -64,4 +87,427 @@ async def test_portfolio_service_full_flow():
         assert detailed["BINANCE (Real)"]["USDT"]["usd_val"] == 100
         
         assert len(errors) == 1
-        assert "BYBIT (Demo)" in errors[0]
\ No newline at end of file
+        assert "BYBIT (Demo)" in errors[0]
+
+# --- Тест ExchangePool ---
+
+@pytest.mark.asyncio
+async def test_exchange_pool_reuses_and_evicts_clients():
+    pool = ExchangePool(max_size=1, idle_ttl=60)
+    factory = MagicMock(side_effect=lambda: AsyncMock())
+
+    async with pool.client((1, False), factory) as first:
+        pass
+    async with pool.client((1, False), factory) as second:
+        pass
+
+    assert first is second
+    assert factory.call_count == 1
+
+    async with pool.client((2, False), factory):
+        pass
+
+    assert len(pool) == 1
+    first.close.assert_awaited_once()
+
+    await pool.close_all()
+    assert len(pool) == 0
+
+
+@pytest.mark.asyncio
+async def test_exchange_pool_evictor_closes_idle_clients_without_traffic():
+    pool = ExchangePool(max_size=10, idle_ttl=0.01)
+    async with pool.client((1, False), lambda: AsyncMock()) as exchange:
+        pass
+
+    evictor = asyncio.create_task(pool.run_evictor(0.01))
+    try:
+        for _ in range(100):
+            if not len(pool):
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        evictor.cancel()
+
+    assert len(pool) == 0
+    exchange.close.assert_awaited_once()
+
+
+# --- Тест TickerCache ---
+
+@pytest.mark.asyncio
+async def test_ticker_cache_coalesces_concurrent_misses():
+    cache = TickerCache(ttl=60)
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"BTC/USDT": {"last": 50000.0}}
+
+    results = await asyncio.gather(*[cache.get(("binance", False), fetch) for _ in range(10)])
+    assert calls == 1
+    assert all(r["BTC/USDT"]["last"] == 50000.0 for r in results)
+
+    await cache.get(("binance", False), fetch)
+    assert calls == 1
+    assert cache.hits == 1
+
+
+# --- Тест MarketStore ---
+
+@pytest.mark.asyncio
+async def test_market_store_snapshot_roundtrip(tmp_path):
+    path = str(tmp_path / "markets.json")
+    store = MarketStore(path, refresh_interval=3600)
+
+    loader = MagicMock()
+    loader.load_markets = AsyncMock()
+    loader.markets = {'BTC/USDT': BTC_USDT_MARKET}
+    loader.currencies = {}
+
+    index = await store.attach("binance", False, loader)
+    assert index.has_pair("BTC", "USDT")
+    assert "info" not in index.markets['BTC/USDT']
+
+    restored = MarketStore(path, refresh_interval=3600)
+    await restored.load_snapshot()
+
+    fresh_client = MagicMock()
+    fresh_client.markets = None
+    index = await restored.attach("binance", False, fresh_client)
+
+    assert index.symbols['BTC/USDT'][:2] == ("BTC", "USDT")
+    fresh_client.set_markets.assert_called_once_with(index.markets, index.currencies)
+    fresh_client.load_markets.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_portfolio_service_streams_fastest_first():
+    mock_repo = AsyncMock()
+    mock_repo.get_user_accounts.return_value = [
+        ExchangeAccount(id=1, exchange_name="kucoin", api_key="k", api_secret="s", is_demo=False),
+        ExchangeAccount(id=2, exchange_name="binance", api_key="k2", api_secret="s2", is_demo=False)
+    ]
+
+    async def fake_balance(exchange_name, *args, **kwargs):
+        await asyncio.sleep(0.05 if exchange_name == "kucoin" else 0)
+        return {"USDT": {"amount": 1, "usd_val": 1}}
+
+    with patch("app.services.portfolio_service.CryptoService") as MockCryptoService:
+        MockCryptoService.get_balance.side_effect = fake_balance
+
+        service = PortfolioService(mock_repo)
+        received = [item async for item in service.iter_portfolio(user_id=1)]
+
+    assert [(label, pending) for label, _, _, pending in received] == [
+        ("BINANCE (Real)", 1),
+        ("KUCOIN (Real)", 0)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_portfolio_service_coalesces_double_tap_while_db_suspends():
+    class SlowRepo:
+        session = AsyncMock()
+
+        async def get_user_accounts(self, user_id):
+            # Справжній запит до БД віддає керування event loop
+            await asyncio.sleep(0.01)
+            return [ExchangeAccount(id=1, exchange_name="okx", api_key="k", api_secret="s", is_demo=False)]
+
+    async def fake_balance(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return {"USDT": {"amount": 1, "usd_val": 1}}
+
+    async def stream(service):
+        return [item async for item in service.iter_portfolio(5)]
+
+    with patch("app.services.portfolio_service.CryptoService") as MockCryptoService:
+        MockCryptoService.get_balance.side_effect = fake_balance
+        first, second, full = await asyncio.gather(
+            stream(PortfolioService(SlowRepo())),
+            stream(PortfolioService(SlowRepo())),
+            PortfolioService(SlowRepo()).get_full_portfolio(5),
+        )
+
+    assert MockCryptoService.get_balance.call_count == 1
+    assert first == second == [("OKX (Real)", {"USDT": {"amount": 1, "usd_val": 1}}, None, 0)]
+    assert full == ({"OKX (Real)": {"USDT": {"amount": 1, "usd_val": 1}}}, [])
+
+
+# --- Тест CircuitBreaker ---
+
+def test_circuit_breaker_opens_and_probes_recovery():
+    breaker = CircuitBreaker(window_size=4, min_calls=2, failure_rate=0.5,
+                             slow_call_seconds=5, reset_timeout=0)
+
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # reset_timeout=0: одразу переходить у half-open і пропускає лише одну пробу
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success(latency=0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_crypto_service_serves_stale_balance_when_circuit_open():
+    last_known_balances[42] = {"BTC": {"amount": 1.0, "usd_val": 50000.0}}
+    breaker = circuit_breakers.get("bybit", False)
+    breaker._open()
+
+    try:
+        result = await CryptoService.get_balance("bybit", "k", "s", account_id=42)
+    finally:
+        last_known_balances.pop(42, None)
+
+    assert "error" in result
+    assert result["stale"]["BTC"]["usd_val"] == 50000.0
+    label, data, error = PortfolioService.split_result("BYBIT (Real)", result)
+    assert label == "BYBIT (Real) (кеш)"
+    assert data["BTC"]["amount"] == 1.0
+    assert error.startswith("❌ BYBIT (Real)")
+
+
+# --- Тест ExchangeScheduler ---
+
+@pytest.mark.asyncio
+async def test_scheduler_round_robins_between_users():
+    scheduler = ExchangeScheduler(rate=1000, burst=1000, concurrency=1)
+    order = []
+
+    def job(name):
+        async def run():
+            order.append(name)
+            return name
+        return run
+
+    futures = [scheduler.submit(("binance", False), "heavy", job(f"heavy-{i}")) for i in range(3)]
+    futures.append(scheduler.submit(("binance", False), "light", job("light-0")))
+
+    results = await asyncio.gather(*futures)
+
+    assert results == ["heavy-0", "heavy-1", "heavy-2", "light-0"]
+    assert order == ["heavy-0", "heavy-1", "light-0", "heavy-2"]
+    stats = scheduler.stats()[("binance", False)]
+    assert stats["completed"] == 4
+    assert stats["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_charges_exchange_call_weights():
+    limits = {"binance": ExchangeLimits(rate=1000, burst=100, weights={"fetch_tickers": 80})}
+    scheduler = ExchangeScheduler(rate=1000, burst=1000, concurrency=4, limits=limits)
+
+    async def fetch():
+        return {}
+
+    started = time.monotonic()
+    # 3 × 80 ваги при запасі 100: третій виклик чекає ~0.14 с, а біржа без власних лімітів — ні
+    for _ in range(3):
+        await scheduler.call(("binance", False), "fetch_tickers", fetch)
+        await scheduler.call(("bybit", False), "fetch_tickers", fetch)
+    assert time.monotonic() - started >= 0.1
+
+    stats = scheduler.stats()
+    assert stats[("binance", False)]["throttled"] >= 0.1
+    assert stats[("bybit", False)]["throttled"] < 0.05
+
+    export_scheduler_stats(stats)
+    assert 'exchange_scheduler_queued{exchange="binance",demo="false"} 0' in registry.render()
+
+
+@pytest.mark.asyncio
+async def test_portfolio_service_serves_fresh_snapshot(db_session):
+    repo = UserRepository(db_session)
+    snapshots = SnapshotRepository(db_session)
+    await repo.create_user_if_not_exists(7, "snap")
+    await snapshots.save(7, {"OKX (Real)": {"BTC": {"amount": 1, "usd_val": 60000}}}, [])
+
+    service = PortfolioService(repo, snapshots)
+    with patch("app.services.portfolio_service.CryptoService") as MockCryptoService:
+        detailed, errors, age = await service.get_cached_portfolio(7, max_age=60)
+        MockCryptoService.get_balance.assert_not_called()
+
+    assert detailed["OKX (Real)"]["BTC"]["usd_val"] == 60000
+    assert errors == []
+    assert age < 60
+
+
+@pytest.mark.asyncio
+async def test_portfolio_service_coalesces_concurrent_fetches():
+    mock_repo = AsyncMock()
+    mock_repo.get_user_accounts.return_value = [
+        ExchangeAccount(id=1, exchange_name="binance", api_key="k", api_secret="s", is_demo=False)
+    ]
+
+    async def slow_balance(*args, **kwargs):
+        await asyncio.sleep(0.02)
+        return {"USDT": {"amount": 10, "usd_val": 10}}
+
+    with patch("app.services.portfolio_service.CryptoService") as MockCryptoService:
+        MockCryptoService.get_balance.side_effect = slow_balance
+
+        first, second = await asyncio.gather(
+            PortfolioService(mock_repo).get_full_portfolio(5),
+            PortfolioService(mock_repo).get_full_portfolio(5)
+        )
+        # Повторний запит одразу після — з короткого кешу результатів
+        third = await PortfolioService(mock_repo).get_full_portfolio(5)
+
+    assert first == second == third
+    assert MockCryptoService.get_balance.call_count == 1
+    assert mock_repo.get_user_accounts.await_count == 1
+
+
+# --- Тест AI ---
+
+@pytest.mark.asyncio
+async def test_stream_gemini_advice_yields_text_chunks():
+    class Chunk:
+        def __init__(self, text):
+            self._text = text
+
+        @property
+        def text(self):
+            if self._text is None:
+                raise ValueError("no text")
+            return self._text
+
+    async def stream():
+        for part in ["📈 BTC ", None, "тримати"]:
+            yield Chunk(part)
+
+    model = MagicMock()
+    model.generate_content_async = AsyncMock(return_value=stream())
+
+    with patch("app.services.ai_service.model", model):
+        chunks = [c async for c in stream_gemini_advice("Що з BTC?", "BTC: 1")]
+
+    assert chunks == ["📈 BTC ", "тримати"]
+    assert model.generate_content_async.await_args.kwargs["stream"] is True
+
+
+@pytest.mark.asyncio
+async def test_ai_answer_cache_reuses_answer_for_similar_portfolio():
+    response = MagicMock(text="🛡 Тримати")
+    model = MagicMock()
+    model.generate_content_async = AsyncMock(return_value=response)
+
+    before = {"BINANCE (Real)": {"BTC": {"amount": 1, "usd_val": 60000}, "USDT": {"amount": 500, "usd_val": 500}}}
+    after = {"BINANCE (Real)": {"BTC": {"amount": 1, "usd_val": 60300}, "USDT": {"amount": 500, "usd_val": 500}}}
+    assert portfolio_fingerprint(before) == portfolio_fingerprint(after)
+
+    with patch("app.services.ai_service.model", model):
+        first = await get_gemini_advice("Чи варто купувати BTC?", "...", portfolio_fingerprint(before))
+        second = await get_gemini_advice("чи варто купувати btc", "...", portfolio_fingerprint(after))
+
+    assert first == second == "🛡 Тримати"
+    assert model.generate_content_async.await_count == 1
+    assert answer_cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_ai_dispatcher_limits_concurrency_and_prioritises_short_prompts():
+    dispatcher = AIDispatcher(concurrency=1, max_queue=5, user_rate=100, user_burst=100, short_prompt_chars=10)
+    order, positions = [], []
+
+    async def ask(user_id, prompt):
+        async def on_position(pos):
+            positions.append((prompt, pos))
+        async with dispatcher.slot(user_id, prompt, on_position):
+            order.append(prompt)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(ask(1, "перше"), ask(2, "дуже довге запитання"), ask(3, "коротке"))
+
+    assert order == ["перше", "коротке", "дуже довге запитання"]
+    assert positions == [("дуже довге запитання", 1), ("коротке", 1)]
+    assert dispatcher.stats()["completed"] == 3
+
+
+@pytest.mark.asyncio
+async def test_ai_dispatcher_rate_limits_user_and_retries_quota():
+    dispatcher = AIDispatcher(concurrency=2, max_queue=5, user_rate=0.01, user_burst=1, short_prompt_chars=10)
+    async with dispatcher.slot(1, "q"):
+        pass
+    with pytest.raises(AIRateLimited) as exc:
+        async with dispatcher.slot(1, "q"):
+            pass
+    assert exc.value.retry_after > 0
+
+    call = AsyncMock(side_effect=[ResourceExhausted("quota"), "ok"])
+    assert await retry_on_quota(call, retries=2, base_delay=0) == "ok"
+    assert call.await_count == 2
+
+
+# --- Тест PortfolioAnalytics ---
+
+def test_portfolio_analytics_metrics_and_local_answers():
+    detailed = {
+        "BINANCE (Real)": {
+            "BTC": {"amount": 0.01, "usd_val": 600.0},
+            "USDT": {"amount": 300, "usd_val": 300.0},
+            "SHIB": {"amount": 10, "usd_val": 0.5},
+            "NOPRICE": {"amount": 5, "usd_val": 0.0}
+        },
+        "OKX (Real)": {"BTC": {"amount": 0.001, "usd_val": 100.0}}
+    }
+    analytics = PortfolioAnalytics(detailed)
+
+    assert analytics.total == pytest.approx(1000.5)
+    assert analytics.share_of("BTC") == pytest.approx(700 / 1000.5)
+    assert analytics.stable_share == pytest.approx(300 / 1000.5)
+    assert analytics.hhi == pytest.approx((700 / 1000.5) ** 2 + (300 / 1000.5) ** 2 + (0.5 / 1000.5) ** 2)
+    assert analytics.dust_count == 1
+
+    assert "70.0%" in analytics.answer("Яка частка BTC?")
+    assert analytics.answer("Чи варто купувати BTC?") is None
+    assert "1 позиціях" in analytics.answer("Скільки в мене пилу?")
+    # Прогнози та запитання, що лише містять схожі літери чи «%», ідуть до Gemini
+    for question in (
+        "Чи впаде BTC на 10%?",
+        "Що буде з портфелем, якщо BTC зросте на 20%?",
+        "Чи купили кити BTC сьогодні?",
+        "Чи скупили кити BTC?",
+    ):
+        assert analytics.answer(question) is None, question
+    assert "BTC 70.0%" in analytics.summary()
+    assert PortfolioAnalytics({}).summary() == "Портфель порожній"
+
+
+# --- Тест ValuationGraph ---
+
+def _spot(base, quote):
+    return {'symbol': f"{base}/{quote}", 'base': base, 'quote': quote, 'spot': True, 'active': True}
+
+
+def test_valuation_graph_routes_through_cross_rates():
+    markets = {m['symbol']: m for m in (
+        _spot('BTC', 'USDT'), _spot('ETH', 'BTC'), _spot('ETH', 'USDT'),
+        _spot('ALT', 'ETH'), _spot('ALT', 'BTC'), _spot('USDT', 'TRY'), _spot('LONE', 'XYZ')
+    )}
+    graph = MarketIndex(markets).valuation
+
+    assert graph.depth['ALT'] == 2
+    assert graph.symbols_for(['ALT']) == {'ALT/BTC', 'ALT/ETH', 'BTC/USDT', 'ETH/USDT'}
+    assert 'LONE' not in graph.routes
+
+    tickers = {
+        'BTC/USDT': {'last': 50000.0}, 'ETH/USDT': {'last': 2500.0},
+        'ALT/BTC': {'last': 0.0001}, 'USDT/TRY': {'last': 40.0}
+    }
+    result = graph.value({'ALT': 10, 'TRY': 400, 'LONE': 5, 'USDT': 1}, tickers)
+
+    # ALT/ETH тікера немає — оцінюємо через BTC
+    assert result['ALT']['usd_val'] == pytest.approx(50.0)
+    # Зворотна пара: TRY котирується як USDT/TRY
+    assert result['TRY']['usd_val'] == pytest.approx(10.0)
+    assert result['LONE']['usd_val'] == 0.0
+    assert result['USDT']['usd_val'] == 1.0
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import pytest
+
+from app.services.scheduler import ExchangeScheduler
+from app.tracing import NOOP_SPAN, span, start_trace, traced
+from bot.middlewares import TracingMiddleware
+
+
+class _Repo:
+    @traced
+    async def load(self):
+        await asyncio.sleep(0)
+        return 42
+
+
+def test_span_outside_trace_is_noop():
+    assert span("anything", key="value") is NOOP_SPAN
+    with span("anything") as s:
+        s.set(ignored=True)
+
+
+@pytest.mark.asyncio
+async def test_nested_spans_follow_tasks_and_scheduler_jobs():
+    # Одна смуга з concurrency=1: завдання другої траси запускає завершене завдання першої
+    scheduler = ExchangeScheduler(rate=1000, burst=1000, concurrency=1)
+
+    async def job(label):
+        with span("exchange", exchange=label):
+            await asyncio.sleep(0.01)
+        return label
+
+    async def update(label):
+        trace = start_trace("update", label=label)
+        with trace:
+            assert await _Repo().load() == 42
+            await asyncio.gather(
+                scheduler.submit(("binance", False), label, lambda: job(f"{label}-1")),
+                scheduler.submit(("binance", False), label, lambda: job(f"{label}-2")),
+            )
+        return trace
+
+    first, second = await asyncio.gather(update("a"), update("b"))
+
+    for trace, label in ((first, "a"), (second, "b")):
+        assert trace.children[0].name == "_Repo.load"
+        jobs = [child for child in trace.children if child.name == "scheduler.job"]
+        assert sorted(job.children[0].attrs["exchange"] for job in jobs) == [f"{label}-1", f"{label}-2"]
+        assert all(job.duration is not None for job in jobs)
+
+
+@pytest.mark.asyncio
+async def test_tracing_middleware_dumps_slow_updates_and_profiles(tmp_path, caplog):
+    middleware = TracingMiddleware(slow_seconds=0.01, profile_rate=1.0, profile_dir=str(tmp_path))
+
+    async def handler(event, data):
+        with span("fetch_balance", exchange="okx"):
+            await asyncio.sleep(0.02)
+
+    async def fast_handler(event, data):
+        pass
+
+    with caplog.at_level(logging.WARNING, logger="bot.middlewares"):
+        await middleware(fast_handler, object(), {})
+        assert not caplog.records
+
+        await middleware(handler, object(), {})
+
+    trace_log = caplog.records[0].getMessage()
+    assert "update" in trace_log and "fetch_balance" in trace_log and "exchange=okx" in trace_log
+    assert len(list(tmp_path.glob("*.prof"))) == 1